@@ -27,6 +27,33 @@ class Settings(BaseSettings):
 
     skip_eq_condition: bool
 
+    connection_idle_timeout: int = 300
+    opc_subscription_interval: int = 1000
+    opc_subscription_max_age: int = 60
+    opc_browse_cache_ttl: int = 300
+    plc_read_gap: int = 32
+    modbus_read_gap: int = 8
+    modbus_async_engine: bool = False
+    modbus_gateway_concurrency: int = 1
+    sensor_read_workers: int = 16
+    sensor_read_deadline: float = 20
+    sensor_config_reload_interval: int = 60
+    device_connect_timeout: float = 3
+    device_read_timeout: float = 3
+    breaker_failure_threshold: int = 3
+    breaker_backoff: float = 5
+    breaker_max_backoff: float = 300
+    acquisition_interval: int = 0
+    trace_jobs: bool = True
+    trace_collection: str = "job_traces"
+    trace_collection_size: int = 16 * 1024 * 1024
+    job_timeseries: bool = True
+    write_buffer: bool = False
+    write_buffer_size: int = 500
+    write_buffer_interval: float = 1
+    write_buffer_max_attempts: int = 5
+    write_buffer_max_size: int = 100000
+
     model_config = SettingsConfigDict(extra="allow", env_file=".env")
 
     def get_settings(self):
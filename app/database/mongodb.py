@@ -1,15 +1,27 @@
 import certifi
+import threading
 from typing import Any
 from datetime import datetime
 from bson import ObjectId
 
 from fastapi import HTTPException
-from pymongo import MongoClient, DESCENDING, errors
+from pymongo import MongoClient, DESCENDING, ReturnDocument, errors
 
 from app.config import settings
+from app.metrics import observe_mongo
+
+
+def _now() -> datetime:
+    # BSON dates keep milliseconds, match what a read back would return
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
 
 
 class MongoDBRepository:
+    # known collection names per database, shared by every repository
+    _collections: dict[str, set[str]] = {}
+    _collections_lock = threading.Lock()
+
     def __init__(self, db_name: str):
         self._client = MongoClient(
             settings.mongodb_url, tlsCAFile=certifi.where()
@@ -29,13 +41,33 @@ class MongoDBRepository:
         except Exception as e:
             raise HTTPException(500, str(e))
 
+    @observe_mongo
+    def load_collections(self) -> set[str]:
+        """ Refresh the collection registry of the database """
+        names = set(self._db.list_collection_names())
+        with self._collections_lock:
+            self._collections[self._db.name] = names
+        return names
+
+    def _register_collection(self, collection_name: str) -> None:
+        with self._collections_lock:
+            self._collections.setdefault(self._db.name, set()).add(collection_name)
+
+    def _unregister_collection(self, collection_name: str) -> None:
+        with self._collections_lock:
+            self._collections.get(self._db.name, set()).discard(collection_name)
+
     def _collection_is_exists(self, collection_name: str) -> bool:
-        return collection_name in self._db.list_collection_names()
+        if collection_name in self._collections.get(self._db.name, ()):
+            return True
+        # created by another worker since the last refresh
+        return collection_name in self.load_collections()
 
     def _validate_collection(self, collection_name: str) -> None:
         if not self._collection_is_exists(collection_name):
             raise HTTPException(404, "Collection not found")
 
+    @observe_mongo
     def create_index(self, collection_name: str, field: str) -> None:
         self._db[collection_name].create_index(
             [(field, DESCENDING)],
@@ -43,8 +75,9 @@ class MongoDBRepository:
         )
 
     def get_collections(self) -> list[str]:
-        return self._db.list_collection_names()
+        return sorted(self.load_collections())
 
+    @observe_mongo
     def get_collection(
             self,
             collection_name: str,
@@ -71,21 +104,93 @@ class MongoDBRepository:
 
         return result
 
+    @observe_mongo
+    def count_documents(
+            self,
+            collection_name: str,
+            query: dict = None
+    ) -> int:
+        self._validate_collection(collection_name)
+        return self._db[collection_name].count_documents(query or {})
+
+    @observe_mongo
     def create_collection(
             self,
-            collection_name: str
+            collection_name: str,
+            granularity: str | None = None
     ) -> None:
-        if not self._collection_is_exists(collection_name):
-            self._db.create_collection(collection_name)
+        """ Create a data collection, a time-series one when granularity is set """
+        if self._collection_is_exists(collection_name):
+            return
+        options = {}
+        if granularity:
+            options["timeseries"] = {
+                "timeField": "datetime",
+                "metaField": "metadata",
+                "granularity": granularity
+            }
+        try:
+            self._db.create_collection(collection_name, **options)
+        except errors.CollectionInvalid:
+            # created concurrently by another worker
+            self._register_collection(collection_name)
+            return
+        if granularity:
+            # time-series collections don't support unique indexes
+            self._db[collection_name].create_index([("datetime", DESCENDING)])
+        else:
             self.create_index(collection_name, "datetime")
+        self._register_collection(collection_name)
 
+    @observe_mongo
+    def create_capped_collection(
+            self,
+            collection_name: str,
+            size: int,
+            index: list[tuple[str, int]] | None = None
+    ) -> None:
+        if self._collection_is_exists(collection_name):
+            return
+        try:
+            self._db.create_collection(collection_name, capped=True, size=size)
+        except errors.CollectionInvalid:
+            # created concurrently by another worker
+            self._register_collection(collection_name)
+            return
+        if index:
+            self._db[collection_name].create_index(index)
+        self._register_collection(collection_name)
+
+    @observe_mongo
     def delete_collection(
             self,
             collection_name: str
     ) -> None:
         if self._collection_is_exists(collection_name):
             self._db.drop_collection(collection_name)
+            self._unregister_collection(collection_name)
 
+    @observe_mongo
+    def rename_collection(
+            self,
+            collection_name: str,
+            new_name: str
+    ) -> None:
+        self._validate_collection(collection_name)
+        self.execute(self._db[collection_name].rename, new_name)
+        self._unregister_collection(collection_name)
+        self._register_collection(new_name)
+
+    @observe_mongo
+    def get_collection_type(self, collection_name: str) -> str | None:
+        """ "collection", "timeseries" or "view", None if it doesn't exist """
+        info = next(self._db.list_collections(filter={"name": collection_name}), None)
+        return info["type"] if info else None
+
+    def watch(self, collection_name: str, **kwargs):
+        return self._db[collection_name].watch(**kwargs)
+
+    @observe_mongo
     def get_document(
             self,
             id: ObjectId,
@@ -94,27 +199,31 @@ class MongoDBRepository:
         self._validate_collection(collection_name)
         return self._db[collection_name].find_one({"_id": id})
 
+    @observe_mongo
     def get_last_document(
             self,
             collection_name: str,
-            validate_collection: bool = True
+            validate_collection: bool = True,
+            sort_by: str = "_id"
     ) -> dict | None:
         if validate_collection:
             self._validate_collection(collection_name)
-        return self._db[collection_name].find_one(sort=[('_id', -1)])
+        return self._db[collection_name].find_one(sort=[(sort_by, -1)])
 
     def _create(self, document: dict, collection_name: str) -> ObjectId:
         result = self._db[collection_name].insert_one(document)
         return result.inserted_id
 
+    @observe_mongo
     def create_document(
             self,
             document: dict,
             set_timestamp: bool,
-            collection_name: str
-    ) -> dict:
+            collection_name: str,
+            return_document: bool = True
+    ) -> dict | None:
         if set_timestamp:
-            now = datetime.now()
+            now = _now()
             document.setdefault('created_at', now)
             document.setdefault('updated_at', now)
 
@@ -122,9 +231,41 @@ class MongoDBRepository:
             self._create, document, collection_name
         )
 
-        return self.get_document(
-            inserted_id, collection_name
+        if not return_document:
+            return None
+        # the inserted document is the written one, no need to read it back
+        document['_id'] = inserted_id
+        return document
+
+    @observe_mongo
+    def create_documents(
+            self,
+            documents: list[dict],
+            collection_name: str
+    ) -> int:
+        """ Insert documents in one round trip, returns the inserted count """
+        result = self.execute(
+            self._db[collection_name].insert_many, documents, ordered=False
         )
+        return len(result.inserted_ids)
+
+    @observe_mongo
+    def try_create_documents(
+            self,
+            documents: list[dict],
+            collection_name: str
+    ) -> list[dict]:
+        """ Insert documents in one round trip, returns the ones that were
+        not inserted, duplicates are already stored and not returned """
+        try:
+            self._db[collection_name].insert_many(documents, ordered=False)
+        except errors.BulkWriteError as e:
+            failed = {
+                error["index"] for error in e.details["writeErrors"]
+                if error["code"] != 11000
+            }
+            return [documents[i] for i in sorted(failed)]
+        return []
 
     def _update(
             self, id: ObjectId, update_fields: dict, collection_name: str
@@ -135,25 +276,41 @@ class MongoDBRepository:
         )
         return result.matched_count
 
+    def _find_and_update(
+            self, id: ObjectId, update_fields: dict, collection_name: str
+    ) -> dict | None:
+        return self._db[collection_name].find_one_and_update(
+            {'_id': id},
+            {'$set': update_fields},
+            return_document=ReturnDocument.AFTER
+        )
+
+    @observe_mongo
     def update_document(
             self,
             id: ObjectId,
             update_fields: dict,
             update_timestamp: bool,
-            collection_name: str
-    ) -> dict:
+            collection_name: str,
+            return_document: bool = True
+    ) -> dict | None:
         if update_timestamp:
-            update_fields['updated_at'] = datetime.now()
+            update_fields['updated_at'] = _now()
 
-        matched_count = self.execute(
-            self._update, id, update_fields, collection_name
-        )
+        if not return_document:
+            if self.execute(self._update, id, update_fields, collection_name) == 0:
+                raise HTTPException(404, "Document not found")
+            return None
 
-        if matched_count == 0:
+        document = self.execute(
+            self._find_and_update, id, update_fields, collection_name
+        )
+        if document is None:
             raise HTTPException(404, "Document not found")
 
-        return self.get_document(id, collection_name)
+        return document
 
+    @observe_mongo
     def delete_document(
             self,
             id: ObjectId,
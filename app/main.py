@@ -3,7 +3,10 @@ from contextlib import asynccontextmanager
 
 from app.config import setup_middleware
 from app.routes.main import setup_routers
+from app.service import data
 from app.service.scheduler import SchedulerService
+from app.service.acquisition import AcquisitionService
+from app.service.write_buffer import WriteBuffer
 from app.service.sensor import SensorClientService
 
 
@@ -11,10 +14,20 @@ from app.service.sensor import SensorClientService
 async def lifespan(app: FastAPI):
     scheduler_service = SchedulerService()
     sensor_service = SensorClientService()
+    acquisition_service = AcquisitionService()
+    write_buffer = WriteBuffer()
     sensor_service.create_indexes()
+    data.repo.load_collections()
+    sensor_service.load_configs()
+    write_buffer.start()
     scheduler_service.start()
+    acquisition_service.start()
     yield
+    acquisition_service.stop()
     scheduler_service.stop()
+    write_buffer.stop()
+    sensor_service.stop_configs()
+    sensor_service.close_connections()
 
 
 def init_app() -> FastAPI:
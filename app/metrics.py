@@ -0,0 +1,72 @@
+import time
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+SENSOR_READ_SECONDS = Histogram(
+    "sensor_read_seconds",
+    "Device read latency, one observation per batch read of an endpoint",
+    ["protocol", "endpoint"],
+)
+SENSOR_READ_ERRORS = Counter(
+    "sensor_read_errors_total",
+    "Sensors that came back faulty",
+    ["protocol", "endpoint"],
+)
+SENSOR_READS = Counter(
+    "sensor_reads_total",
+    "Sensors read from devices",
+    ["protocol", "endpoint"],
+)
+
+MONGO_OPERATION_SECONDS = Histogram(
+    "mongo_operation_seconds",
+    "MongoDBRepository call latency",
+    ["method"],
+)
+
+JOB_RUN_SECONDS = Histogram(
+    "job_run_seconds",
+    "Job run duration from its scheduled run time to completion",
+    ["job"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+JOB_RUNS = Counter(
+    "job_runs_total",
+    "Finished job runs",
+    ["job", "outcome"],
+)
+SCHEDULER_PENDING_RUNS = Gauge(
+    "scheduler_pending_runs",
+    "Submitted job runs that have not finished yet",
+)
+SCHEDULER_MISSED_RUNS = Counter(
+    "scheduler_missed_runs_total",
+    "Job runs skipped by the scheduler",
+    ["job", "reason"],
+)
+
+TELEGRAM_SEND_SECONDS = Histogram(
+    "telegram_send_seconds",
+    "Telegram API call latency per attempt",
+    ["method"],
+)
+TELEGRAM_RATE_LIMIT_RETRIES = Counter(
+    "telegram_rate_limit_retries_total",
+    "Telegram calls retried after a 429 response",
+    ["method"],
+)
+
+
+def observe_mongo(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            MONGO_OPERATION_SECONDS.labels(func.__name__).observe(
+                time.perf_counter() - start
+            )
+    return wrapper
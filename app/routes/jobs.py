@@ -56,6 +56,14 @@ def send_report(name: str):
     return {"message": f"Report job for ({name}) created successfully"}
 
 
+@router.get(
+    "/{name}/traces",
+    response_model=list[schemas.JobTraceSchema],
+)
+def get_slowest_runs(name: str, hours: int = 24, limit: int = 10):
+    return service.get_slowest_runs(name, hours, limit)
+
+
 @router.get(
     "/{name}/pause",
     response_model=dict,
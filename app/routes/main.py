@@ -4,6 +4,8 @@ from .opc import router as router_opc
 from .plc import router as router_plc
 from .tcp_modbus import router as router_tcp_modbus
 from .jobs import router as router_jobs
+from .sensors import router as router_sensors
+from .metrics import router as router_metrics
 from app.service.websocket import router as router_ws
 
 
@@ -12,4 +14,6 @@ def setup_routers(app: FastAPI) -> None:
     app.include_router(router_plc, prefix="/api/plc", tags=["Plc Sensors"])
     app.include_router(router_tcp_modbus, prefix="/api/tcp-modbus", tags=["Tcp Modbus Sensors"])
     app.include_router(router_jobs, prefix="/api/jobs", tags=["Jobs"])
+    app.include_router(router_sensors, prefix="/api/sensors", tags=["Sensors"])
     app.include_router(router_ws, prefix="/api", tags=["Websocket"])
+    app.include_router(router_metrics)
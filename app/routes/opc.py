@@ -1,4 +1,5 @@
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import IPvAnyAddress, conint
 
 from app.service.opc import OpcSensorService
@@ -50,6 +51,24 @@ def get_node_tree(
     )
 
 
+@router.get(
+    "/node/tree/stream",
+    response_class=StreamingResponse,
+)
+def stream_node_tree(
+        ip_address: IPvAnyAddress,
+        port: conint(ge=1, le=65535),
+        max_depth: int = 3
+):
+    nodes = service.browse_node_tree(
+        str(ip_address), port, max_depth
+    )
+    return StreamingResponse(
+        (node.model_dump_json() + "\n" for node in nodes),
+        media_type="application/x-ndjson"
+    )
+
+
 @router.post(
     "",
     status_code=201,
@@ -92,6 +111,6 @@ def check_value(dto: schemas.OpcSensorCreate):
     "/{id}/check-value",
     response_model=TitleValueSchema,
 )
-def check_value_by_id(id: str):
-    data, _ = service.get_value_by_id(id)
+def check_value_by_id(id: str, max_age: float = None):
+    data, _ = service.get_value_by_id(id, max_age=max_age)
     return data
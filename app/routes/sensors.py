@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+
+from app.service.sensor import SensorClientService
+from app.schemas import sensor as schemas
+
+
+router = APIRouter()
+service = SensorClientService()
+
+
+@router.get(
+    "/breakers",
+    response_model=list[schemas.BreakerSchema],
+)
+def get_breakers():
+    return service.get_breakers()
+
+
+@router.post(
+    "/read",
+    response_model=list[schemas.SensorReadSchema],
+)
+def read_sensors(sensors: list[schemas.Sensor], max_age: float = None):
+    return service.read_values(sensors, max_age)
@@ -77,6 +77,6 @@ def check_value(dto: schemas.TcpModbusSensorCreate):
     "/{id}/check-value",
     response_model=TitleValueSchema,
 )
-def check_value_by_id(id: str):
-    data, _ = service.get_value_by_id(id)
+def check_value_by_id(id: str, max_age: float = None):
+    data, _ = service.get_value_by_id(id, max_age=max_age)
     return data
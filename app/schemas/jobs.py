@@ -4,6 +4,7 @@ from pydantic import (
     BaseModel, constr, model_validator, conint, computed_field
 )
 from apscheduler.job import Job
+from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
 
@@ -62,6 +63,12 @@ class JobDetails(BaseModel):
             )
         return self
 
+    def to_apscheduler(self) -> IntervalTrigger | CronTrigger:
+        if self.trigger == "interval":
+            task = self.periodic_task
+            return IntervalTrigger(**{task.metric: task.interval})
+        return CronTrigger(**self.cron_task.model_dump())
+
     @classmethod
     def from_apscheduler(cls, trigger):
         if isinstance(trigger, IntervalTrigger):
@@ -97,6 +104,7 @@ class JobCreate(BaseModel):
     summation: bool | None = False
     speed_info: bool | None = False
     shift_report: bool | None = False
+    max_age: conint(ge=0) | None = None
 
     @computed_field
     def multiple_sensors(self) -> bool:
@@ -131,6 +139,7 @@ class JobSchema(BaseModel):
     summation: bool
     speed_info: bool
     shift_report: bool
+    max_age: int | None = None
 
     next_run_time: datetime | None
 
@@ -158,5 +167,22 @@ class JobSchema(BaseModel):
             summation=args.get("summation", summation),
             speed_info=args.get("speed_info", False),
             shift_report=args.get("shift_report"),
+            max_age=args.get("max_age"),
             next_run_time=job.next_run_time if not exclude else None
         )
+
+
+class SpanSchema(BaseModel):
+    name: str
+    start: float
+    duration: float
+    error: str | None = None
+
+
+class JobTraceSchema(BaseModel):
+    job: str
+    func: str
+    started_at: datetime
+    duration: float
+    outcome: Literal["success", "error"]
+    spans: list[SpanSchema]
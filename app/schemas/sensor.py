@@ -3,11 +3,14 @@ from datetime import datetime
 from typing_extensions import Annotated
 
 from pydantic import (
-    BaseModel, ConfigDict, Field, constr, IPvAnyAddress, conint, field_serializer
+    BaseModel, ConfigDict, Field, constr, IPvAnyAddress, conint,
+    field_serializer, model_validator
 )
 from pydantic.functional_validators import BeforeValidator
 from opcua.ua import NodeId
 
+from app.schemas.data import TitleValueSchema
+
 
 PyObjectId = Annotated[str, BeforeValidator(str)]
 ModbusDataType = Literal[
@@ -18,6 +21,10 @@ ModbusDataType = Literal[
     # "STRING", "BITS"
 ]
 WordOrder = Literal["big", "little"]
+PlcDataType = Literal["BOOL", "INT", "WORD", "DINT", "REAL", "LREAL"]
+PLC_DATA_TYPE_SIZES = {
+    "BOOL": 1, "INT": 2, "WORD": 2, "DINT": 4, "REAL": 4, "LREAL": 8
+}
 Port = conint(ge=1, le=65535)
 
 
@@ -56,6 +63,7 @@ class OpcSensorCreate(BaseSensorCreateModel):
     description: constr(min_length=3, max_length=100)
     port: Port
     node_id: OpcNodeID
+    subscribe: bool = False
     enabled: bool = True
     metric_unit: constr(min_length=3, max_length=30)
     coefficient: float
@@ -68,6 +76,7 @@ class OpcSensorUpdate(BaseSensorCreateModel):
     ip_address: IPvAnyAddress = None
     port: Port = None
     node_id: OpcNodeID = None
+    subscribe: bool = None
     enabled: bool = None
     metric_unit: constr(min_length=3, max_length=30) = None
     coefficient: float = None
@@ -76,12 +85,20 @@ class OpcSensorUpdate(BaseSensorCreateModel):
 class OpcNodeSchema(BaseModel):
     browse_name: str
     node_id: OpcNodeID
-    value: float
+    value: float | None = None
     children: list["OpcNodeSchema"] | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class OpcBrowseNodeSchema(BaseModel):
+    browse_name: str
+    node_id: OpcNodeID
+    parent_id: OpcNodeID | None = None
+    depth: int
+    value: float | None = None
+
+
 class OpcSensorSchema(BaseModel):
     id: PyObjectId = Field(alias='_id', default=None)
     name: str
@@ -90,6 +107,7 @@ class OpcSensorSchema(BaseModel):
     ip_address: str
     port: int
     node_id: OpcNodeID
+    subscribe: bool = False
     enabled: bool
     metric_unit: str
     coefficient: float
@@ -99,6 +117,14 @@ class OpcSensorSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+def check_plc_size(size: int, data_type: str) -> None:
+    if size < PLC_DATA_TYPE_SIZES[data_type]:
+        raise ValueError(
+            f"size must be at least {PLC_DATA_TYPE_SIZES[data_type]}"
+            f" bytes for {data_type}"
+        )
+
+
 class PlcSensorCreate(BaseSensorCreateModel):
     name: constr(min_length=3, max_length=30)
     title: constr(min_length=3, max_length=30)
@@ -108,10 +134,17 @@ class PlcSensorCreate(BaseSensorCreateModel):
     slot: int
     offset: int
     size: int
+    data_type: PlcDataType = "REAL"
+    bit: conint(ge=0, le=7) = 0
     enabled: bool = True
     metric_unit: constr(min_length=3, max_length=30)
     coefficient: float
 
+    @model_validator(mode="after")
+    def check_size(self):
+        check_plc_size(self.size, self.data_type)
+        return self
+
 
 class PlcSensorUpdate(BaseSensorCreateModel):
     name: constr(min_length=3, max_length=30) = None
@@ -123,6 +156,8 @@ class PlcSensorUpdate(BaseSensorCreateModel):
     slot: int = None
     offset: int = None
     size: int = None
+    data_type: PlcDataType = None
+    bit: conint(ge=0, le=7) = None
     enabled: bool = None
     metric_unit: constr(min_length=3, max_length=30) = None
     coefficient: float = None
@@ -139,6 +174,8 @@ class PlcSensorSchema(BaseModel):
     slot: int
     offset: int
     size: int
+    data_type: PlcDataType = "REAL"
+    bit: int = 0
     enabled: bool
     metric_unit: str
     coefficient: float
@@ -203,3 +240,20 @@ class TcpModbusSensorSchema(BaseModel):
 class Sensor(BaseModel):
     id: str
     type: Literal["opc", "plc", "tcp_modbus"]
+
+
+class BreakerSchema(BaseModel):
+    protocol: str
+    endpoint: str
+    state: Literal["closed", "open", "half_open"]
+    failures: int
+    retry_in: float
+
+
+class SensorReadSchema(BaseModel):
+    id: str
+    type: Literal["opc", "plc", "tcp_modbus"]
+    data: TitleValueSchema | None = None
+    is_fault: bool
+    error: str | None = None
+    latency: float | None = None
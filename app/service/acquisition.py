@@ -0,0 +1,68 @@
+import time
+import logging
+import threading
+
+from app.service.base import SingletonMeta
+from app.service.scheduler import SchedulerService
+from app.service.sensor import SensorClientService
+from app.schemas.sensor import Sensor
+from app.config import settings
+
+
+class AcquisitionService(metaclass=SingletonMeta):
+    """ Samples every sensor referenced by active jobs once per
+    acquisition interval, jobs are served from the latest values.
+    Off by default, the interval must not exceed the fastest job period """
+
+    def __init__(self):
+        self.scheduler_service = SchedulerService()
+        self.sensor_service = SensorClientService()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def get_sensors(self) -> list[Sensor]:
+        """ Distinct sensors of all scheduled, not paused, jobs """
+        sensors = {}
+        for job in self.scheduler_service.scheduler.get_jobs():
+            if job.next_run_time is None:
+                continue
+            for sensor in job.kwargs.get("sensors", []):
+                sensors.setdefault(sensor["id"], Sensor(**sensor))
+        return list(sensors.values())
+
+    def acquire(self) -> None:
+        sensors = self.get_sensors()
+        read_at = time.monotonic()
+        # results land in the latest value store the jobs read from
+        self.sensor_service.read_sensors(sensors, False)
+        logging.info(
+            f"| ACQUISITION | Sampled {len(sensors)} sensors"
+            f" in {time.monotonic() - read_at:.2f}s"
+        )
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.acquire()
+            except Exception:
+                logging.exception("| ACQUISITION | Error sampling sensors")
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, settings.acquisition_interval - elapsed))
+
+    def start(self) -> None:
+        if settings.acquisition_interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="acquisition", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=settings.sensor_read_deadline)
+            self._thread = None
@@ -1,7 +1,13 @@
+import time
+from typing import Hashable
+
 from bson import ObjectId
 from fastapi import HTTPException
 
+from app import metrics
 from app.database.mongodb import MongoDBRepository
+from app.service.config_cache import SensorConfigCache
+from app.service.cache import latest_values
 from app.schemas.data import TitleValueSchema
 from app.config import settings
 
@@ -16,9 +22,14 @@ class SingletonMeta(type):
 
 
 class BaseSensorService(metaclass=SingletonMeta):
+    protocol = "sensor"
+
     def __init__(self, collection_name: str):
         self.repo = MongoDBRepository(settings.mongodb_sensors_db)
         self.collection_name = collection_name
+        self.configs = SensorConfigCache(self.repo, collection_name)
+        self.values = latest_values
+        self.configs.listeners.append(self.values.pop)
 
     @staticmethod
     def _check_coefficient(coefficient: float) -> float:
@@ -52,44 +63,54 @@ class BaseSensorService(metaclass=SingletonMeta):
         )
 
     def _get_by_id(self, id: str) -> dict:
+        sensor = self.configs.get(id)
+        if sensor is not None:
+            return sensor
+
         sensor = self.repo.get_document(ObjectId(id), self.collection_name)
         if sensor is None:
             raise HTTPException(404, "Sensor not found")
+        self.configs.put(sensor)
         return sensor
 
     def _create(self, dto) -> dict:
         dto.enabled = True
         self._read_by_dto(dto)
-        return self.repo.create_document(
+        sensor = self.repo.create_document(
             dto.model_dump(), True, self.collection_name
         )
+        self.configs.put(sensor)
+        return sensor
+
+    def _update(self, id: str, values: dict) -> dict:
+        sensor = self.repo.update_document(
+            ObjectId(id), values, True, self.collection_name
+        )
+        self.configs.put(sensor)
+        return sensor
 
     def create_index(self):
         self.repo.create_index(self.collection_name, "name")
 
     def delete(self, id: str):
         self.repo.delete_document(ObjectId(id), self.collection_name)
+        self.configs.pop(id)
+        self.values.pop(id)
 
     @staticmethod
     def _read_sensor(dto) -> int | float | None:
         raise NotImplementedError("Subclasses must implement `_read_sensor`")
 
-    def _read_by_dto(
+    def _read_sensors(self, dtos: list) -> list[int | float | None]:
+        return [self._read_sensor(dto) for dto in dtos]
+
+    def _build_result(
             self,
             dto,
-            return_as_schema: bool = False,
-            raise_exception: bool = True,
+            value: int | float | None,
+            return_as_schema: bool,
+            raise_exception: bool,
     ) -> tuple[int | float | TitleValueSchema | None, bool]:
-        if not dto.enabled:
-            if raise_exception:
-                raise HTTPException(
-                    403, f"Sensor {dto.name} is disabled"
-                )
-            return None, False
-
-        coefficient = self._check_coefficient(dto.coefficient)
-        value = self._read_sensor(dto)
-
         if value is None:
             if raise_exception:
                 raise HTTPException(
@@ -98,6 +119,7 @@ class BaseSensorService(metaclass=SingletonMeta):
             # 2nd value indicates fault
             return None, True
 
+        coefficient = self._check_coefficient(dto.coefficient)
         weighted_value = coefficient * value
 
         if return_as_schema:
@@ -106,3 +128,92 @@ class BaseSensorService(metaclass=SingletonMeta):
             ), False
 
         return weighted_value, False
+
+    def _store_value(
+            self,
+            dto,
+            result: tuple[TitleValueSchema | None, bool],
+            started: float,
+            latency: float
+    ) -> None:
+        # sensors from check-value requests are not stored yet
+        id = getattr(dto, "id", None)
+        if id is not None:
+            self.values.put(id, *result, latency, started)
+
+    def _observe_reads(
+            self,
+            dtos: list,
+            results: list[tuple[TitleValueSchema | None, bool]],
+            latency: float
+    ) -> None:
+        endpoints = set()
+        for dto, (_, is_fault) in zip(dtos, results):
+            port = getattr(dto, "port", None)
+            endpoint = f"{dto.ip_address}:{port}" if port else str(dto.ip_address)
+            metrics.SENSOR_READS.labels(self.protocol, endpoint).inc()
+            if is_fault:
+                metrics.SENSOR_READ_ERRORS.labels(self.protocol, endpoint).inc()
+            endpoints.add(endpoint)
+        for endpoint in endpoints:
+            metrics.SENSOR_READ_SECONDS.labels(self.protocol, endpoint).observe(latency)
+
+    def _read_by_dto(
+            self,
+            dto,
+            return_as_schema: bool = False,
+            raise_exception: bool = True,
+            max_age: float | None = None,
+    ) -> tuple[int | float | TitleValueSchema | None, bool]:
+        if not dto.enabled:
+            if raise_exception:
+                raise HTTPException(
+                    403, f"Sensor {dto.name} is disabled"
+                )
+            return None, False
+
+        id = getattr(dto, "id", None)
+        cached = self.values.get(id, max_age) if id and max_age is not None else None
+        if cached is not None and not cached.is_fault:
+            if return_as_schema:
+                return cached.data, False
+            return cached.data.value, False
+
+        started, start = time.time(), time.perf_counter()
+        value = self._read_sensor(dto)
+        latency = time.perf_counter() - start
+        result = self._build_result(dto, value, True, False)
+        self._store_value(dto, result, started, latency)
+        self._observe_reads([dto], [result], latency)
+        return self._build_result(dto, value, return_as_schema, raise_exception)
+
+    def _read_by_dtos(
+            self, dtos: list
+    ) -> list[tuple[TitleValueSchema | None, bool]]:
+        """ Read enabled sensors in one batch, disabled ones yield (None, False) """
+        enabled = [dto for dto in dtos if dto.enabled]
+        started, start = time.time(), time.perf_counter()
+        values = iter(self._read_sensors(enabled))
+        latency = time.perf_counter() - start
+
+        results = []
+        for dto in dtos:
+            if not dto.enabled:
+                results.append((None, False))
+                continue
+            result = self._build_result(dto, next(values), True, False)
+            self._store_value(dto, result, started, latency)
+            results.append(result)
+        self._observe_reads(
+            enabled, [r for dto, r in zip(dtos, results) if dto.enabled], latency
+        )
+        return results
+
+    def endpoint_key(self, dto) -> Hashable:
+        """ Sensors sharing a key are read together over one connection """
+        return str(dto.ip_address)
+
+    def get_values(
+            self, dtos: list
+    ) -> list[tuple[TitleValueSchema | None, bool]]:
+        return self._read_by_dtos(dtos)
@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+from typing import Hashable
+
+from app.config import settings
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """ closed -> open after repeated connection failures, open -> half-open
+    once the backoff elapses, the half-open probe closes or reopens it """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, key: Hashable):
+        self.name = name
+        self.key = key
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """ True while calls should be rejected without touching the device """
+        return self.state == self.OPEN and time.monotonic() < self.retry_at
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state != self.OPEN:
+                return True
+            if time.monotonic() < self.retry_at:
+                return False
+            self.state = self.HALF_OPEN
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"| {self.name} | Circuit closed: {self.key}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if (
+                    self.state == self.CLOSED
+                    and self.failures < settings.breaker_failure_threshold
+            ):
+                return
+            backoff = min(
+                settings.breaker_backoff * 2 ** self.opened,
+                settings.breaker_max_backoff
+            )
+            self.opened += 1
+            self.state = self.OPEN
+            self.retry_at = time.monotonic() + backoff
+            logging.warning(
+                f"| {self.name} | Circuit open for {backoff:.0f}s: {self.key}"
+            )
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit open: {self.key}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = max(0.0, self.retry_at - time.monotonic())
+            return {
+                "endpoint": str(self.key),
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": round(retry_in, 1) if self.state == self.OPEN else 0.0,
+            }
+
+
+class CircuitBreakers:
+    """ One breaker per endpoint """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._breakers: dict[Hashable, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(self.name, key)
+                self._breakers[key] = breaker
+            return breaker
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.snapshot() for breaker in breakers]
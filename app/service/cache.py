@@ -0,0 +1,52 @@
+import time
+import threading
+from typing import NamedTuple
+
+from app.schemas.data import TitleValueSchema
+
+
+class LatestValue(NamedTuple):
+    data: TitleValueSchema | None
+    is_fault: bool
+    timestamp: float
+    latency: float
+
+
+class LatestValueStore:
+    """ Last read of every stored sensor, keyed by sensor id """
+
+    def __init__(self):
+        self._values: dict[str, LatestValue] = {}
+        self._lock = threading.Lock()
+
+    def put(
+            self,
+            id: str,
+            data: TitleValueSchema | None,
+            is_fault: bool,
+            latency: float,
+            timestamp: float | None = None
+    ) -> None:
+        value = LatestValue(data, is_fault, timestamp or time.time(), latency)
+        with self._lock:
+            current = self._values.get(id)
+            # a slow read must not overwrite a newer sample
+            if current is None or current.timestamp <= value.timestamp:
+                self._values[id] = value
+
+    def get(self, id: str, max_age: float | None = None) -> LatestValue | None:
+        """ Latest value of the sensor if it is at most `max_age` seconds old """
+        with self._lock:
+            value = self._values.get(id)
+        if value is None:
+            return None
+        if max_age is not None and time.time() - value.timestamp > max_age:
+            return None
+        return value
+
+    def pop(self, id: str) -> None:
+        with self._lock:
+            self._values.pop(id, None)
+
+
+latest_values = LatestValueStore()
@@ -0,0 +1,125 @@
+import logging
+import threading
+from typing import Callable
+
+from fastapi import HTTPException
+from pymongo import errors
+
+from app.database.mongodb import MongoDBRepository
+from app.config import settings
+
+
+class SensorConfigCache:
+    """ Process-wide copy of a sensor collection kept in sync with Mongo,
+    through a change stream or by periodic reloads on standalone servers """
+
+    def __init__(self, repo: MongoDBRepository, collection_name: str):
+        self.repo = repo
+        self.collection_name = collection_name
+        self.listeners: list[Callable[[str], None]] = []
+        self._configs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _notify(self, id: str) -> None:
+        for listener in self.listeners:
+            listener(id)
+
+    def get(self, id: str) -> dict | None:
+        with self._lock:
+            return self._configs.get(id)
+
+    def put(self, document: dict) -> None:
+        id = str(document["_id"])
+        with self._lock:
+            self._configs[id] = document
+        self._notify(id)
+
+    def pop(self, id: str) -> None:
+        with self._lock:
+            self._configs.pop(id, None)
+        self._notify(id)
+
+    def load(self) -> None:
+        try:
+            documents = self.repo.get_collection(self.collection_name, limit=0)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            documents = []
+
+        configs = {str(document["_id"]): document for document in documents}
+        with self._lock:
+            changed = [
+                id for id in self._configs.keys() | configs.keys()
+                if self._configs.get(id) != configs.get(id)
+            ]
+            self._configs = configs
+        for id in changed:
+            self._notify(id)
+        logging.info(f"| CONFIG | Loaded {len(configs)} sensors from {self.collection_name}")
+
+    def _apply(self, change: dict) -> None:
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            if change.get("fullDocument") is not None:
+                self.put(change["fullDocument"])
+            else:
+                self.pop(str(change["documentKey"]["_id"]))
+        elif operation == "delete":
+            self.pop(str(change["documentKey"]["_id"]))
+        elif operation in ("drop", "rename", "invalidate"):
+            self.load()
+
+    def _poll(self) -> None:
+        while not self._stop.wait(settings.sensor_config_reload_interval):
+            try:
+                self.load()
+            except Exception:
+                logging.exception(f"| CONFIG | Error reloading {self.collection_name}")
+
+    def _watch(self) -> None:
+        resync = False
+        while not self._stop.is_set():
+            try:
+                with self.repo.watch(
+                        self.collection_name,
+                        full_document="updateLookup",
+                        max_await_time_ms=1000
+                ) as stream:
+                    # events may have been missed while the stream was down
+                    if resync:
+                        self.load()
+                    resync = True
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._apply(change)
+            except errors.OperationFailure:
+                logging.info(
+                    f"| CONFIG | Change streams unavailable, reloading"
+                    f" {self.collection_name} every"
+                    f" {settings.sensor_config_reload_interval}s"
+                )
+                self._poll()
+                return
+            except Exception:
+                logging.exception(f"| CONFIG | Error watching {self.collection_name}")
+                self._stop.wait(settings.sensor_config_reload_interval)
+
+    def start(self) -> None:
+        self.load()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name=f"config-{self.collection_name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
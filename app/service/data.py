@@ -4,9 +4,11 @@ from operator import itemgetter
 
 from app import utils
 from app.service import idle
+from app.service.tracing import span, traced
 from app.service.sensor import SensorClientService
 from app.service.telegram import TelegramBotService
 from app.service.websocket import send_rvo_data
+from app.service.write_buffer import WriteBuffer
 from app.database import MongoDBRepository
 
 from app.schemas.sensor import Sensor
@@ -17,6 +19,31 @@ from app.config import settings
 repo = MongoDBRepository(settings.mongodb_db)
 tg_service = TelegramBotService(settings.tg_api_key, settings.tg_chat_id)
 sensor_service = SensorClientService()
+write_buffer = WriteBuffer()
+# this process is the only writer of job collections,
+# None marks a collection known to be empty
+last_documents: dict[str, dict | None] = {}
+
+
+def get_last_document(
+        collection_name: str, validate_collection: bool = True
+) -> dict | None:
+    """ Get the last sample, including samples not flushed yet """
+    if collection_name in last_documents:
+        return last_documents[collection_name]
+    doc = write_buffer.last(collection_name)
+    if doc is None:
+        doc = repo.get_last_document(
+            collection_name, validate_collection, "datetime"
+        )
+    last_documents[collection_name] = doc
+    return doc
+
+
+def forget_collection(collection_name: str) -> None:
+    """ Drop the cached and pending samples of a deleted collection """
+    last_documents.pop(collection_name, None)
+    write_buffer.discard(collection_name)
 
 
 def calculate_production(
@@ -24,7 +51,7 @@ def calculate_production(
 ) -> tuple[float, float]:
     """ Calculate the production for the shift """
     produced, speed_for_shift = 0.0, 0.0
-    doc = repo.get_last_document(collection_name + "_shift_report", False)
+    doc = get_last_document(collection_name + "_shift_report", False)
     if doc:
         last_value = doc.get("value", 0.0)
         if current_value >= last_value:
@@ -42,8 +69,9 @@ def calculate_day_production(
         collection_name: str, difference: float
 ) -> float:
     """ Calculate the total production for the day """
+    write_buffer.flush(collection_name)
     doc = repo.get_collection(
-        collection_name=collection_name, limit=1, skip=1
+        collection_name=collection_name, sort_by="datetime", limit=1, skip=1
     )
     doc = doc[0] if doc else None
     produced = doc.get("difference", 0.0) + difference
@@ -54,6 +82,7 @@ def calculate_day_production(
 def get_weekly_data(collection_name: str) -> list[dict] | None:
     """ Get the data for the current week """
     start_of_week = utils.get_start_of_week()
+    write_buffer.flush(collection_name)
     week_data = repo.get_collection(
         collection_name=collection_name,
         sort_by="datetime",
@@ -71,8 +100,10 @@ def get_daily_data(
         shift_end: datetime
 ) -> list[dict] | None:
     """ Get the data for the current shift """
+    collection_name = collection_name.replace("_shift_report", "")
+    write_buffer.flush(collection_name)
     daily_data = repo.get_collection(
-        collection_name=collection_name.replace("_shift_report", ""),
+        collection_name=collection_name,
         sort_by="datetime",
         query={"datetime": {
             "$gte": shift_start.astimezone(utils.TIMEZONE),
@@ -138,7 +169,8 @@ def get_ext_data(
         shift_report: bool
 ) -> schemas.DataSchemaExt | None:
     """ Get the extended data for the current timestamp """
-    doc = repo.get_last_document(collection_name, False)
+    with span("get_last_document"):
+        doc = get_last_document(collection_name, False)
     if not doc:
         return schemas.DataSchemaExt(
             value=dto.value, difference=0.0,
@@ -179,11 +211,19 @@ def store_data(
     if not data:
         return None
 
-    repo.create_document(
-        collection_name=collection_name,
-        document=data.model_dump(),
-        set_timestamp=False
-    )
+    document = data.model_dump()
+    # metaField of time-series job collections
+    document["metadata"] = {"job": collection_name}
+    if settings.write_buffer:
+        write_buffer.add(collection_name, document)
+    else:
+        repo.create_document(
+            collection_name=collection_name,
+            document=document,
+            set_timestamp=False,
+            return_document=False
+        )
+    last_documents[collection_name] = document
 
     return data
 
@@ -222,6 +262,7 @@ def _process_multiple_report(
         tg_service.send_report_plot(title, img_path)
 
 
+@traced
 def process_cumulative_data(
         collection_name: str,
         job_description: str,
@@ -229,38 +270,50 @@ def process_cumulative_data(
         tg_send: bool,
         shift_report: bool,
         speed_info: bool,
-        chat: str | None
+        chat: str | None,
+        max_age: int | None = None
 ):
     sensors = [Sensor(**sensor) for sensor in sensors]
-    values, is_zero, has_fault = sensor_service.read_sensors_by_id(sensors, True)
-    data = store_data(collection_name, values, True, shift_report)
+    with span("read_sensors"):
+        values, is_zero, has_fault = sensor_service.read_sensors_by_id(
+            sensors, True, max_age
+        )
+    with span("store_data"):
+        data = store_data(collection_name, values, True, shift_report)
 
     if not data and tg_send:
-        idle.notify_idle(collection_name, job_description, chat, has_fault)
+        with span("notify_idle"):
+            idle.notify_idle(collection_name, job_description, chat, has_fault)
         return
     idle.reset_counter(collection_name)
 
     if not shift_report:
         shift_start, _, shift_name = utils.calculate_shift()
-        produced, speed_for_shift = calculate_production(
-            collection_name, data.value, speed_info
-        )
+        with span("calculate_production"):
+            produced, speed_for_shift = calculate_production(
+                collection_name, data.value, speed_info
+            )
         produced = produced if produced > 0 else data.difference
-        message = utils.production_message(
-            data.speed, speed_for_shift, produced,
-            data.metric_unit, shift_name, job_description,
-            speed_info
-        )
-        tg_service.send_production_message(message, chat)
-        if collection_name == "Rvo_Production_Job":
-            send_rvo_data(
-                shift_start, shift_name, data.speed,
-                speed_for_shift, produced
+        with span("build_message"):
+            message = utils.production_message(
+                data.speed, speed_for_shift, produced,
+                data.metric_unit, shift_name, job_description,
+                speed_info
             )
+        with span("telegram_send"):
+            tg_service.send_production_message(message, chat)
+        if collection_name == "Rvo_Production_Job":
+            with span("websocket_broadcast"):
+                send_rvo_data(
+                    shift_start, shift_name, data.speed,
+                    speed_for_shift, produced
+                )
     else:
-        _process_cumulative_report(collection_name, job_description, data)
+        with span("shift_report"):
+            _process_cumulative_report(collection_name, job_description, data)
 
 
+@traced
 def process_data(
         collection_name: str,
         job_description: str,
@@ -268,32 +321,42 @@ def process_data(
         tg_send: bool,
         shift_report: bool,
         summation: bool,
-        chat: str | None
+        chat: str | None,
+        max_age: int | None = None
 ):
     if not shift_report:
         _, _, shift_name = utils.calculate_shift()
         sensors = [Sensor(**sensor) for sensor in sensors]
-        values, is_zero, has_fault = sensor_service.read_sensors_by_id(sensors, summation)
-        doc = repo.get_last_document(collection_name)
+        with span("read_sensors"):
+            values, is_zero, has_fault = sensor_service.read_sensors_by_id(
+                sensors, summation, max_age
+            )
+        with span("get_last_document"):
+            doc = get_last_document(collection_name)
         data = [value.model_dump() for value in values]
 
         if is_zero or (
                 not settings.skip_eq_condition and (
                 doc and doc['values'] == data
         )):
-            idle.notify_idle(collection_name, job_description, chat, has_fault)
+            with span("notify_idle"):
+                idle.notify_idle(collection_name, job_description, chat, has_fault)
             return
         idle.reset_counter(collection_name)
 
-        data = store_data(collection_name, values, False)
+        with span("store_data"):
+            data = store_data(collection_name, values, False)
 
         if tg_send:
-            message = utils.custom_message_template(
-                data.values, shift_name, job_description
-            )
-            tg_service.send_production_message(message, chat)
+            with span("build_message"):
+                message = utils.custom_message_template(
+                    data.values, shift_name, job_description
+                )
+            with span("telegram_send"):
+                tg_service.send_production_message(message, chat)
     if shift_report and tg_send:
-        _process_multiple_report(collection_name, job_description)
+        with span("shift_report"):
+            _process_multiple_report(collection_name, job_description)
 
 
 def send_report(
@@ -303,8 +366,9 @@ def send_report(
 ) -> bool:
     collection_name = re.sub(r"(_am|_pm)$", "", collection_name)
     if diff_field:
+        write_buffer.flush(collection_name)
         data = repo.get_collection(
-            collection_name=collection_name, limit=1, skip=0
+            collection_name=collection_name, sort_by="datetime", limit=1, skip=0
         )
         if len(data) == 0:
             return False
@@ -1,13 +1,13 @@
 from fastapi import HTTPException
 
 from app import utils
-from app.service import data
+from app.service import data, tracing
 from app.service.scheduler import SchedulerService
 from app.service.sensor import SensorClientService
 from app.database import MongoDBRepository
 
 from app.schemas.jobs import (
-    JobCreate, CronTask, PeriodicTask, JobSchema
+    JobCreate, CronTask, PeriodicTask, JobSchema, JobTraceSchema
 )
 from app.config import settings
 
@@ -17,6 +17,10 @@ scheduler_service = SchedulerService()
 sensor_service = SensorClientService()
 
 
+def create_collection(name: str, granularity: str) -> None:
+    repo.create_collection(name, granularity if settings.job_timeseries else None)
+
+
 def add_cron_job(
         job_name: str, func: callable, details: CronTask, args: dict
 ) -> JobSchema:
@@ -47,7 +51,8 @@ def validate_job_args(
         shift_report: bool,
         summation: bool,
         speed_info: bool,
-        chat: str | None
+        chat: str | None,
+        max_age: int | None
 ):
     if func == data.process_cumulative_data:
         return {
@@ -57,7 +62,8 @@ def validate_job_args(
             "tg_send": tg_send,
             "shift_report": shift_report,
             "speed_info": speed_info,
-            "chat": chat
+            "chat": chat,
+            "max_age": max_age
         }
     if func == data.process_data:
         return {
@@ -67,7 +73,8 @@ def validate_job_args(
             "tg_send": tg_send,
             "shift_report": shift_report,
             "summation": summation,
-            "chat": chat
+            "chat": chat,
+            "max_age": max_age
         }
     return None
 
@@ -76,7 +83,8 @@ def create_report_job(dto: JobCreate, sensors: list[dict]) -> list[JobSchema]:
     dto.name = dto.name + "_shift_report"
     if dto.diff_field:
         func = data.process_cumulative_data
-        repo.create_collection(dto.name)
+        # two reports a day
+        create_collection(dto.name, "hours")
     else:
         func = data.process_data
 
@@ -92,7 +100,7 @@ def create_report_job(dto: JobCreate, sensors: list[dict]) -> list[JobSchema]:
         args = validate_job_args(
             func, dto.name, dto.description,
             sensors, dto.tg_send, dto.shift_report,
-            dto.summation, dto.speed_info, dto.chat
+            dto.summation, dto.speed_info, dto.chat, dto.max_age
         )
         jobs.append(add_cron_job(job_name, func, details, args))
 
@@ -119,7 +127,9 @@ def create_job(dto: JobCreate) -> list[JobSchema]:
     sensors = sensor_service.validate_sensor_args(
         dto.opc_sensors_id, dto.plc_sensors_id, dto.tcp_modbus_sensors_id
     )
-    repo.create_collection(dto.name)
+    create_collection(
+        dto.name, utils.get_granularity(dto.details.to_apscheduler())
+    )
 
     if dto.diff_field:
         func = data.process_cumulative_data
@@ -129,7 +139,7 @@ def create_job(dto: JobCreate) -> list[JobSchema]:
     args = validate_job_args(
         func, dto.name, dto.description,
         sensors, dto.tg_send, False,
-        dto.summation, dto.speed_info, dto.chat
+        dto.summation, dto.speed_info, dto.chat, dto.max_age
     )
 
     result, jobs = [], []
@@ -162,6 +172,7 @@ def delete_job(name: str, remove_collection: bool = False, delete_all: bool = Fa
         scheduler_service.remove_job(name)
 
     if remove_collection:
+        data.forget_collection(name)
         repo.delete_collection(name)
 
     if delete_all:
@@ -172,4 +183,16 @@ def delete_job(name: str, remove_collection: bool = False, delete_all: bool = Fa
                 shift_report = True
                 scheduler_service.remove_job(shift_job_name)
         if shift_report:
+            data.forget_collection(name + "_shift_report")
             repo.delete_collection(name + "_shift_report")
+
+
+def get_slowest_runs(name: str, hours: int, limit: int) -> list[JobTraceSchema]:
+    # runs are traced by collection, both shift report jobs share one
+    collection_name = name
+    for suffix in ["_shift_report_am", "_shift_report_pm"]:
+        if name.endswith(suffix):
+            collection_name = name.removesuffix(suffix[-3:])
+
+    traces = tracing.get_slowest_runs(collection_name, hours, limit)
+    return [JobTraceSchema(**trace) for trace in traces]
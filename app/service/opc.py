@@ -1,23 +1,42 @@
+import time
 import logging
+import threading
+from typing import Iterator
+from collections import defaultdict
 
-from bson import ObjectId
 from fastapi import HTTPException
-from opcua import Client, Node
+from opcua import Client, Node, ua
 
 from app.schemas import sensor as schemas
 from app.schemas.data import TitleValueSchema
-from app.service.base import BaseSensorService
+from app.service.base import BaseSensorService, SingletonMeta
+from app.service.pool import ConnectionPool
+from app.config import settings
+
+
+MAX_NODES_PER_REQUEST = 500
+
+
+def opc_url(ip_address: str, port: int) -> str:
+    return f"opc.tcp://{ip_address}:{port}"
+
+
+class OpcNodeError(Exception):
+    """ The server answered with a bad status or no value for the node """
 
 
 class OpcClient:
-    def __init__(self, ip_address: str, port: int):
-        self.opc_url = f"opc.tcp://{ip_address}:{port}"
+    def __init__(self, url: str):
+        self.opc_url = url
         self.client = None
 
     def connect(self):
         if self.client is None:
-            self.client = Client(self.opc_url)
+            self.client = Client(self.opc_url, timeout=settings.device_connect_timeout)
         self.client.connect()
+        # python-opcua has one timeout for the connect and every request,
+        # the socket reads it per request
+        self.client.uaclient._uasocket.timeout = settings.device_read_timeout
 
     def disconnect(self):
         if self.client is not None:
@@ -31,71 +50,303 @@ class OpcClient:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
-    def read_value(self, node_id: schemas.OpcNodeID) -> float:
+    def is_connected(self) -> bool:
+        if self.client is None:
+            return False
+        # the receiving thread exits as soon as the socket is closed
+        socket = self.client.uaclient._uasocket
+        receiver = socket._thread if socket is not None else None
+        keepalive = self.client.keepalive
+        return (
+            receiver is not None and receiver.is_alive()
+            and keepalive is not None and keepalive.is_alive()
+        )
+
+    def read_value(self, node_id: ua.NodeId) -> float:
+        # the status of the node is its own answer, session and channel
+        # errors are raised by the Read call itself
+        result = self.read_attributes([node_id], ua.AttributeIds.Value)[0]
+        if not result.StatusCode.is_good():
+            raise OpcNodeError(f"Bad status: {result.StatusCode.name}")
+        if result.Value.Value is None:
+            raise OpcNodeError("No data available for the specified Node ID.")
+        logging.info(f"| OPC | Read value from: {self.opc_url}, node_id='{node_id.to_string()}'")
+        return result.Value.Value
+
+    def read_attributes(
+            self, node_ids: list[ua.NodeId], attribute: ua.AttributeIds
+    ) -> list[ua.DataValue]:
         if self.client is None:
             raise Exception("Not connected to OPC server.")
-        node = self.client.get_node(str(node_id))
-        value = node.get_value()
-        if value is None:
-            raise Exception("No data available for the specified Node ID.")
-        logging.info(f"| OPC | Read value from: {self.opc_url}, node_id='{node_id}'")
-        return value
-
-    def get_root(self):
+
+        results = []
+        for i in range(0, len(node_ids), MAX_NODES_PER_REQUEST):
+            params = ua.ReadParameters()
+            for node_id in node_ids[i:i + MAX_NODES_PER_REQUEST]:
+                read_value = ua.ReadValueId()
+                read_value.NodeId = node_id
+                read_value.AttributeId = attribute
+                params.NodesToRead.append(read_value)
+            results.extend(self.client.uaclient.read(params))
+        return results
+
+    def read_values(
+            self, node_ids: list[ua.NodeId]
+    ) -> list[float | None]:
+        """ Read many nodes with one Read service call per chunk,
+        a bad status only faults its own node """
+        results = self.read_attributes(node_ids, ua.AttributeIds.Value)
+
+        values = []
+        for node_id, result in zip(node_ids, results):
+            if result.StatusCode.is_good() and result.Value.Value is not None:
+                values.append(result.Value.Value)
+            else:
+                logging.error(
+                    f"| OPC | Bad status for: {self.opc_url},"
+                    f" node_id='{node_id.to_string()}', status={result.StatusCode.name}"
+                )
+                values.append(None)
+
+        logging.info(f"| OPC | Read {len(node_ids)} values from: {self.opc_url}")
+        return values
+
+    def browse_children(
+            self, node_ids: list[ua.NodeId]
+    ) -> list[list[ua.ReferenceDescription]]:
+        """ Browse hierarchical references of many nodes at once,
+        following continuation points """
         if self.client is None:
             raise Exception("Not connected to OPC server.")
-        return self.client.get_root_node()
 
-    def get_node_tree(
-            self,
-            node: Node,
-            depth: int = 0,
-            max_depth: int = 3
-    ) -> schemas.OpcNodeSchema | None:
-        if depth > max_depth:
+        children = []
+        for i in range(0, len(node_ids), MAX_NODES_PER_REQUEST):
+            params = ua.BrowseParameters()
+            for node_id in node_ids[i:i + MAX_NODES_PER_REQUEST]:
+                description = ua.BrowseDescription()
+                description.NodeId = node_id
+                description.BrowseDirection = ua.BrowseDirection.Forward
+                description.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+                description.IncludeSubtypes = True
+                description.NodeClassMask = 0
+                description.ResultMask = ua.BrowseResultMask.All
+                params.NodesToBrowse.append(description)
+
+            results = self.client.uaclient.browse(params)
+            references = [list(result.References) for result in results]
+            pending = {
+                result.ContinuationPoint: j
+                for j, result in enumerate(results) if result.ContinuationPoint
+            }
+            while pending:
+                next_params = ua.BrowseNextParameters()
+                next_params.ContinuationPoints = list(pending)
+                next_results = self.client.uaclient.browse_next(next_params)
+                next_pending = {}
+                for point, result in zip(next_params.ContinuationPoints, next_results):
+                    references[pending[point]].extend(result.References)
+                    if result.ContinuationPoint:
+                        next_pending[result.ContinuationPoint] = pending[point]
+                pending = next_pending
+            children.extend(references)
+
+        return children
+
+
+class OpcSessionPool(ConnectionPool, metaclass=SingletonMeta):
+    name = "OPC"
+
+    def __init__(self):
+        super().__init__(settings.connection_idle_timeout)
+
+    def _connect(self, key: str) -> OpcClient:
+        client = OpcClient(key)
+        client.connect()
+        return client
+
+    def _disconnect(self, client: OpcClient) -> None:
+        client.disconnect()
+
+    def _is_alive(self, client: OpcClient) -> bool:
+        return client.is_connected()
+
+    def _is_answer(self, error: Exception) -> bool:
+        return isinstance(error, OpcNodeError)
+
+
+class OpcSubscription:
+    """ Dedicated session with one subscription, data-change
+    notifications are kept as the latest value per node """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = OpcClient(url)
+        self.subscription = None
+        self.handles: dict[ua.NodeId, int] = {}
+        self.values: dict[ua.NodeId, tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def datachange_notification(self, node: Node, val, data) -> None:
+        if data.monitored_item.Value.StatusCode.is_good() and val is not None:
+            self.values[node.nodeid] = (val, time.time())
+        else:
+            self.values.pop(node.nodeid, None)
+
+    def status_change_notification(self, status) -> None:
+        logging.warning(f"| OPC | Subscription status changed: {self.url}, {status}")
+        self.values.clear()
+
+    def is_alive(self) -> bool:
+        return self.subscription is not None and self.client.is_connected()
+
+    def get_value(self, node_id: ua.NodeId) -> float | None:
+        if not self.is_alive():
+            return None
+        item = self.values.get(node_id)
+        if item is None or time.time() - item[1] > settings.opc_subscription_max_age:
             return None
+        return item[0]
 
+    def refresh(self, node_id: ua.NodeId, value: float, timestamp: float) -> None:
+        """ Polled value for a monitored node, data-change notifications
+        only come on change so a steady value is confirmed this way """
+        item = self.values.get(node_id)
+        if node_id in self.handles and (item is None or item[1] < timestamp):
+            self.values[node_id] = (value, timestamp)
+
+    def _monitor(self, node_ids: list[ua.NodeId]) -> None:
+        nodes = [self.client.client.get_node(node_id) for node_id in node_ids]
+        results = self.subscription.subscribe_data_change(nodes)
+        for node_id, result in zip(node_ids, results):
+            if isinstance(result, ua.StatusCode):
+                logging.error(
+                    f"| OPC | Error subscribing to: {self.url},"
+                    f" node_id='{node_id.to_string()}', status={result.name}"
+                )
+            else:
+                self.handles[node_id] = result
+
+    def subscribe(self, node_ids: list[ua.NodeId]) -> None:
+        with self.lock:
+            if not self.is_alive():
+                self.close()
+                self.client.connect()
+                self.subscription = self.client.client.create_subscription(
+                    settings.opc_subscription_interval, self
+                )
+                node_ids = list(self.handles.keys() | set(node_ids))
+                self.handles.clear()
+            new_nodes = [node_id for node_id in node_ids if node_id not in self.handles]
+            if new_nodes:
+                self._monitor(new_nodes)
+                logging.info(f"| OPC | Subscribed to {len(new_nodes)} nodes on: {self.url}")
+
+    def unsubscribe(self, node_id: ua.NodeId) -> None:
+        with self.lock:
+            self.values.pop(node_id, None)
+            handle = self.handles.pop(node_id, None)
+            if handle is not None and self.is_alive():
+                self.subscription.unsubscribe(handle)
+                logging.info(f"| OPC | Unsubscribed from 1 node on: {self.url}")
+
+    def close(self) -> None:
+        self.values.clear()
+        self.subscription = None
         try:
-            browse_name = node.get_browse_name().to_string()
-            value = None
+            self.client.disconnect()
+        except Exception:
+            self.client.client = None
 
-            try:
-                raw_value = node.get_value()
-                if isinstance(raw_value, (int, float)):
-                    value = raw_value
-            except:
-                pass
-
-            children = []
-            for child in node.get_children():
-                child_data = self.get_node_tree(child, depth + 1, max_depth)
-                if child_data:
-                    children.append(child_data)
-
-            if value is None and not children:
-                return None
-
-            return schemas.OpcNodeSchema(
-                browse_name=browse_name,
-                node_id=schemas.OpcNodeID.from_node_id(node.nodeid),
-                value=value,
-                children=children
-            )
+
+class OpcSubscriptionService(metaclass=SingletonMeta):
+    def __init__(self):
+        self._subscriptions: dict[str, OpcSubscription] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, url: str) -> OpcSubscription:
+        with self._lock:
+            if url not in self._subscriptions:
+                self._subscriptions[url] = OpcSubscription(url)
+            return self._subscriptions[url]
+
+    def get_value(self, url: str, node_id: ua.NodeId) -> float | None:
+        subscription = self._subscriptions.get(url)
+        return subscription.get_value(node_id) if subscription else None
+
+    def subscribe(self, url: str, node_ids: list[ua.NodeId]) -> None:
+        try:
+            self._get(url).subscribe(node_ids)
+        except Exception:
+            logging.error(f"| OPC | Error creating subscription on: {url}")
+
+    def refresh(self, url: str, node_id: ua.NodeId, value: float, timestamp: float) -> None:
+        subscription = self._subscriptions.get(url)
+        if subscription:
+            subscription.refresh(node_id, value, timestamp)
+
+    def unsubscribe(self, url: str, node_id: ua.NodeId) -> None:
+        subscription = self._subscriptions.get(url)
+        if subscription is None:
+            return
+        try:
+            subscription.unsubscribe(node_id)
         except Exception:
-            raise
+            logging.error(
+                f"| OPC | Error unsubscribing from: {url},"
+                f" node_id='{node_id.to_string()}'"
+            )
+
+    def close_all(self) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            subscription.close()
 
 
 class OpcSensorService(BaseSensorService):
+    protocol = "opc"
+
     def __init__(self):
         super().__init__("opc_sensors")
+        self.pool = OpcSessionPool()
+        self.subscriptions = OpcSubscriptionService()
+        self._browse_cache: dict[str, tuple[float, int, list[schemas.OpcBrowseNodeSchema]]] = {}
+        self._node_ids: dict[str, ua.NodeId] = {}
+        self._subscribed: dict[str, tuple[str, ua.NodeId]] = {}
+        self._subscribed_lock = threading.Lock()
+        self.configs.listeners.append(lambda id: self._node_ids.pop(id, None))
+        self.configs.listeners.append(self._release_subscription)
+
+    def _release_subscription(self, id: str) -> None:
+        """ Drop the monitored item of a changed or deleted sensor,
+        the next read subscribes again if the sensor still asks for it """
+        with self._subscribed_lock:
+            item = self._subscribed.pop(id, None)
+            if item is None or item in self._subscribed.values():
+                return
+        self.subscriptions.unsubscribe(*item)
+
+    def _get_node_id(
+            self, dto: schemas.OpcSensorSchema | schemas.OpcSensorCreate
+    ) -> ua.NodeId:
+        """ Parsed NodeId, cached for stored sensors """
+        id = getattr(dto, "id", None)
+        node_id = self._node_ids.get(id) if id else None
+        if node_id is None:
+            node_id = ua.NodeId.from_string(str(dto.node_id))
+            if id:
+                self._node_ids[id] = node_id
+        return node_id
 
-    @staticmethod
     def _read_sensor(
-            dto: schemas.OpcSensorSchema | schemas.OpcSensorCreate
+            self, dto: schemas.OpcSensorSchema | schemas.OpcSensorCreate
     ) -> float | None:
         try:
-            with OpcClient(str(dto.ip_address), dto.port) as client:
-                return client.read_value(dto.node_id)
+            return self.pool.run(
+                opc_url(str(dto.ip_address), dto.port),
+                lambda client: client.read_value(self._get_node_id(dto))
+            )
         except Exception:
             logging.error(
                 "| OPC | Error reading value from:"
@@ -104,16 +355,129 @@ class OpcSensorService(BaseSensorService):
             )
             return None
 
-    @staticmethod
-    def get_node_tree(
-            ip: str, port: int, max_depth: int
-    ) -> schemas.OpcNodeSchema:
-        try:
-            with OpcClient(ip, port) as client:
-                root = client.get_root()
-                return client.get_node_tree(
-                    node=root, max_depth=max_depth
+    def endpoint_key(
+            self, dto: schemas.OpcSensorSchema | schemas.OpcSensorCreate
+    ) -> str:
+        return opc_url(str(dto.ip_address), dto.port)
+
+    def _read_sensors(
+            self, dtos: list[schemas.OpcSensorSchema | schemas.OpcSensorCreate]
+    ) -> list[float | None]:
+        values = [None] * len(dtos)
+        endpoints, subscribe = defaultdict(list), defaultdict(list)
+        for i, dto in enumerate(dtos):
+            url = opc_url(str(dto.ip_address), dto.port)
+            # unsaved sensors are only polled, nothing would unsubscribe them
+            if dto.subscribe and getattr(dto, "id", None):
+                node_id = self._get_node_id(dto)
+                values[i] = self.subscriptions.get_value(url, node_id)
+                if values[i] is not None:
+                    continue
+                subscribe[url].append(i)
+            endpoints[url].append(i)
+
+        polled_at = time.time()
+
+        for url, indexes in endpoints.items():
+            node_ids = [self._get_node_id(dtos[i]) for i in indexes]
+            try:
+                result = self.pool.run(
+                    url, lambda client: client.read_values(node_ids)
+                )
+            except Exception:
+                logging.error(
+                    f"| OPC | Error reading {len(node_ids)} values from: {url}"
                 )
+                continue
+            for i, value in zip(indexes, result):
+                values[i] = value
+
+        for url, indexes in subscribe.items():
+            node_ids = [self._get_node_id(dtos[i]) for i in indexes]
+            with self._subscribed_lock:
+                for i, node_id in zip(indexes, node_ids):
+                    self._subscribed[dtos[i].id] = (url, node_id)
+            self.subscriptions.subscribe(url, node_ids)
+            for i, node_id in zip(indexes, node_ids):
+                if values[i] is not None:
+                    self.subscriptions.refresh(url, node_id, values[i], polled_at)
+
+        return values
+
+    def _browse(
+            self, url: str, max_depth: int
+    ) -> Iterator[schemas.OpcBrowseNodeSchema]:
+        """ Breadth-first browse, one Read and one Browse call per level """
+        root_id = ua.NodeId(ua.ObjectIds.RootFolder)
+        root_name = self.pool.run(
+            url, lambda client: client.read_attributes(
+                [root_id], ua.AttributeIds.BrowseName
+            )
+        )[0].Value.Value.to_string()
+
+        level = [(root_id, root_name, None, ua.NodeClass.Object)]
+        visited, records = {root_id}, []
+        for depth in range(max_depth + 1):
+            variables = [
+                node_id for node_id, _, _, node_class in level
+                if node_class == ua.NodeClass.Variable
+            ]
+
+            def read_level(client: OpcClient):
+                values = client.read_attributes(variables, ua.AttributeIds.Value) if variables else []
+                children = client.browse_children([node[0] for node in level]) if depth < max_depth else []
+                return values, children
+
+            values, children = self.pool.run(url, read_level)
+            values = dict(zip(variables, values))
+
+            for node_id, browse_name, parent_id, _ in level:
+                value = values.get(node_id)
+                if value is not None:
+                    value = value.Value.Value if value.StatusCode.is_good() else None
+                record = schemas.OpcBrowseNodeSchema(
+                    browse_name=browse_name,
+                    node_id=schemas.OpcNodeID.from_node_id(node_id),
+                    parent_id=schemas.OpcNodeID.from_node_id(parent_id) if parent_id else None,
+                    depth=depth,
+                    value=value if isinstance(value, (int, float)) else None
+                )
+                records.append(record)
+                yield record
+
+            next_level = []
+            for (parent_id, *_), references in zip(level, children):
+                for reference in references:
+                    node_id = reference.NodeId
+                    if node_id in visited or not isinstance(node_id.Identifier, (int, str)):
+                        continue
+                    visited.add(node_id)
+                    next_level.append((
+                        node_id, reference.BrowseName.to_string(),
+                        parent_id, reference.NodeClass
+                    ))
+            if not next_level:
+                break
+            level = next_level
+
+        self._browse_cache[url] = (time.monotonic(), max_depth, records)
+
+    def browse_node_tree(
+            self, ip: str, port: int, max_depth: int
+    ) -> Iterator[schemas.OpcBrowseNodeSchema]:
+        """ Stream nodes as they are discovered, served from the
+        per-endpoint cache while it is fresh and deep enough """
+        url = opc_url(ip, port)
+        cached = self._browse_cache.get(url)
+        if (
+                cached and cached[1] >= max_depth
+                and time.monotonic() - cached[0] < settings.opc_browse_cache_ttl
+        ):
+            return (record for record in cached[2] if record.depth <= max_depth)
+
+        nodes = self._browse(url, max_depth)
+        try:
+            first = next(nodes)
         except Exception:
             logging.error(
                 "| OPC | Error reading node tree from:"
@@ -121,6 +485,41 @@ class OpcSensorService(BaseSensorService):
             )
             raise HTTPException(400, "Error reading node tree")
 
+        def stream():
+            yield first
+            try:
+                yield from nodes
+            except Exception:
+                logging.error(f"| OPC | Node tree browse interrupted: {url}")
+
+        return stream()
+
+    def get_node_tree(
+            self, ip: str, port: int, max_depth: int
+    ) -> schemas.OpcNodeSchema:
+        records = list(self.browse_node_tree(ip, port, max_depth))
+
+        # children are complete before their parent when walking backwards
+        children, tree = defaultdict(list), None
+        for record in reversed(records):
+            nodes = children.pop(str(record.node_id), [])[::-1]
+            if record.value is None and not nodes:
+                continue
+            node = schemas.OpcNodeSchema(
+                browse_name=record.browse_name,
+                node_id=record.node_id,
+                value=record.value,
+                children=nodes
+            )
+            if record.parent_id is None:
+                tree = node
+            else:
+                children[str(record.parent_id)].append(node)
+
+        if tree is None:
+            raise HTTPException(404, "No nodes with values found")
+        return tree
+
     def get_all(
             self,
             name: str | None,
@@ -153,14 +552,15 @@ class OpcSensorService(BaseSensorService):
 
         sensor.__dict__.update(values)
         sensor.enabled = True
+        # check as an unsaved sensor, nothing gets cached under its id until
+        # the update is stored, the config listener drops the old NodeId then
+        sensor.id = None
         self._read_by_dto(sensor)
 
         if values.get("node_id"):
             values["node_id"] = values["node_id"].model_dump()
 
-        sensor = self.repo.update_document(
-            ObjectId(id), values, True, self.collection_name
-        )
+        sensor = self._update(id, values)
         return schemas.OpcSensorSchema(**sensor)
 
     def get_value(self, dto: schemas.OpcSensorCreate) -> TitleValueSchema:
@@ -168,7 +568,7 @@ class OpcSensorService(BaseSensorService):
         return data
 
     def get_value_by_id(
-            self, id: str, raise_exception: bool = True
+            self, id: str, raise_exception: bool = True, max_age: float | None = None
     ) -> tuple[TitleValueSchema | None, bool]:
         sensor = self.get_by_id(id)
-        return self._read_by_dto(sensor, True, raise_exception)
+        return self._read_by_dto(sensor, True, raise_exception, max_age)
@@ -1,13 +1,93 @@
 import logging
-from bson import ObjectId
+from collections import defaultdict
+
 from fastapi import HTTPException
 
+import numpy as np
 import snap7
-import snap7.util as util
 
+from app import utils
 from app.schemas import sensor as schemas
 from app.schemas.data import TitleValueSchema
-from app.service.base import BaseSensorService
+from app.service.base import BaseSensorService, SingletonMeta
+from app.service.pool import ConnectionPool
+from app.config import settings
+
+
+# S7 header and data item overhead of a read response
+PDU_READ_OVERHEAD = 18
+
+# S7 stores values big-endian
+PLC_DTYPES = {
+    "BOOL": np.dtype("u1"),
+    "INT": np.dtype(">i2"),
+    "WORD": np.dtype(">u2"),
+    "DINT": np.dtype(">i4"),
+    "REAL": np.dtype(">f4"),
+    "LREAL": np.dtype(">f8"),
+}
+
+
+def is_plc_answer(error: Exception) -> bool:
+    """ The PLC answered with an error (bad DB or address), as opposed to
+    a timeout or a broken connection, snap7 only reports it as text """
+    message = error.args[0] if error.args else b""
+    if isinstance(message, bytes):
+        message = message.decode(errors="replace")
+    return str(message).strip().startswith("CPU :")
+
+
+def decode_buffer(
+        buffer: bytearray, tags: list[tuple[int, str, int]]
+) -> list[int | float | None]:
+    """ Decode (offset, data type, bit) tags out of one DB buffer
+    with a single vectorized gather per data type,
+    tags that don't fit the buffer are left None """
+    data = np.frombuffer(memoryview(buffer), dtype=np.uint8)
+    groups = defaultdict(list)
+    for i, (offset, data_type, _) in enumerate(tags):
+        if 0 <= offset <= len(data) - PLC_DTYPES[data_type].itemsize:
+            groups[data_type].append(i)
+
+    values = [None] * len(tags)
+    for data_type, indexes in groups.items():
+        dtype = PLC_DTYPES[data_type]
+        offsets = np.fromiter(
+            (tags[i][0] for i in indexes), dtype=np.intp, count=len(indexes)
+        )
+        raw = data[offsets[:, None] + np.arange(dtype.itemsize)]
+        if data_type == "BOOL":
+            bits = np.fromiter(
+                (tags[i][2] for i in indexes), dtype=np.uint8, count=len(indexes)
+            )
+            decoded = (raw[:, 0] >> bits) & 1
+        else:
+            decoded = raw.view(dtype).ravel()
+        for i, value in zip(indexes, decoded.tolist()):
+            values[i] = value
+
+    return values
+
+
+def decode_members(
+        dtos: list[schemas.PlcSensorSchema | schemas.PlcSensorCreate],
+        members: list[int],
+        start: int,
+        buffer: bytearray,
+        values: list[float | None]
+) -> None:
+    """ Decode sensors out of the buffer of one read, sensors
+    smaller than their data type are left None """
+    members = [
+        i for i in members
+        if dtos[i].size >= PLC_DTYPES[dtos[i].data_type].itemsize
+    ]
+    tags = [
+        (dtos[i].offset - start, dtos[i].data_type, dtos[i].bit)
+        for i in members
+    ]
+    for i, value in zip(members, decode_buffer(buffer, tags)):
+        values[i] = value
 
 
 class Snap7Client:
@@ -16,6 +96,11 @@ class Snap7Client:
         self.rack = rack
         self.slot = slot
         self.client = snap7.client.Client()
+        self.client.set_param(
+            snap7.types.PingTimeout, int(settings.device_connect_timeout * 1000)
+        )
+        for param in (snap7.types.SendTimeout, snap7.types.RecvTimeout):
+            self.client.set_param(param, int(settings.device_read_timeout * 1000))
 
     def connect(self):
         self.client.connect(self.ip, self.rack, self.slot)
@@ -31,25 +116,74 @@ class Snap7Client:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
-    def read_db(self, db_number: int, start: int, size: int) -> float:
+    def is_connected(self) -> bool:
+        return self.client.get_connected()
+
+    def read_db(
+            self,
+            db_number: int,
+            start: int,
+            size: int,
+            data_type: str = "REAL",
+            bit: int = 0
+    ) -> int | float | None:
         if not self.client.get_connected():
             raise Exception("Not connected to PLC.")
         byte_array = self.client.db_read(db_number, start, size)
         logging.info(f"| PLC | Read value from: {self.ip}, rack={self.rack}")
-        return util.get_real(byte_array, 0)
+        return decode_buffer(byte_array, [(0, data_type, bit)])[0]
+
+    def read_area(self, db_number: int, start: int, size: int) -> bytearray:
+        if not self.client.get_connected():
+            raise Exception("Not connected to PLC.")
+        return self.client.db_read(db_number, start, size)
+
+    def max_read_size(self) -> int:
+        return self.client.get_pdu_length() - PDU_READ_OVERHEAD
+
+
+class Snap7ConnectionPool(ConnectionPool, metaclass=SingletonMeta):
+    name = "PLC"
+
+    def __init__(self):
+        super().__init__(settings.connection_idle_timeout)
+
+    def _connect(self, key: tuple[str, int, int]) -> Snap7Client:
+        client = Snap7Client(*key)
+        try:
+            client.connect()
+        except Exception:
+            client.client.destroy()
+            raise
+        return client
+
+    def _disconnect(self, client: Snap7Client) -> None:
+        client.disconnect()
+
+    def _is_alive(self, client: Snap7Client) -> bool:
+        return client.is_connected()
+
+    def _is_answer(self, error: Exception) -> bool:
+        return is_plc_answer(error)
 
 
 class PlcSensorService(BaseSensorService):
+    protocol = "plc"
+
     def __init__(self):
         super().__init__("plc_sensors")
+        self.pool = Snap7ConnectionPool()
 
-    @staticmethod
     def _read_sensor(
-            dto: schemas.PlcSensorSchema | schemas.PlcSensorCreate
+            self, dto: schemas.PlcSensorSchema | schemas.PlcSensorCreate
     ) -> float | None:
         try:
-            with Snap7Client(str(dto.ip_address), dto.rack, dto.slot) as client:
-                return client.read_db(dto.db, dto.offset, dto.size)
+            return self.pool.run(
+                (str(dto.ip_address), dto.rack, dto.slot),
+                lambda client: client.read_db(
+                    dto.db, dto.offset, dto.size, dto.data_type, dto.bit
+                )
+            )
         except Exception:
             logging.error(
                 "| PLC | Error reading value from:"
@@ -58,6 +192,92 @@ class PlcSensorService(BaseSensorService):
             )
             return None
 
+    @staticmethod
+    def _read_plc(
+            client: Snap7Client,
+            dtos: list[schemas.PlcSensorSchema | schemas.PlcSensorCreate]
+    ) -> list[float | None]:
+        """ Read every DB block with merged db_read calls,
+        each sensor is sliced out of the returned bytes """
+        blocks = defaultdict(list)
+        for i, dto in enumerate(dtos):
+            blocks[dto.db].append(i)
+
+        values, requests = [None] * len(dtos), 0
+        max_size = client.max_read_size()
+        for db, indexes in blocks.items():
+            spans = [(dtos[i].offset, dtos[i].size) for i in indexes]
+            plan = utils.plan_reads(spans, max_size, settings.plc_read_gap)
+            for start, size, members in plan:
+                members = [indexes[m] for m in members]
+                # timeouts and connection errors fail the whole PLC,
+                # retrying its tags one by one would only stall again
+                try:
+                    requests += 1
+                    data = client.read_area(db, start, size)
+                except Exception as e:
+                    if not is_plc_answer(e):
+                        raise
+                    data = None
+
+                if data is not None:
+                    decode_members(dtos, members, start, data, values)
+                elif len(members) > 1:
+                    # one bad offset fails a merged read, retry its tags one by one
+                    for i in members:
+                        try:
+                            requests += 1
+                            values[i] = client.read_db(
+                                db, dtos[i].offset, dtos[i].size,
+                                dtos[i].data_type, dtos[i].bit
+                            )
+                        except Exception as e:
+                            if not is_plc_answer(e):
+                                raise
+
+                for i in members:
+                    if values[i] is None:
+                        logging.error(
+                            f"| PLC | Error reading value from: ip={client.ip},"
+                            f" db={db}, start={dtos[i].offset}, size={dtos[i].size}"
+                        )
+
+        logging.info(
+            f"| PLC | Read {len(dtos)} values from: {client.ip},"
+            f" rack={client.rack} in {requests} requests"
+        )
+        return values
+
+    def endpoint_key(
+            self, dto: schemas.PlcSensorSchema | schemas.PlcSensorCreate
+    ) -> tuple[str, int, int]:
+        return str(dto.ip_address), dto.rack, dto.slot
+
+    def _read_sensors(
+            self, dtos: list[schemas.PlcSensorSchema | schemas.PlcSensorCreate]
+    ) -> list[float | None]:
+        plcs = defaultdict(list)
+        for i, dto in enumerate(dtos):
+            plcs[(str(dto.ip_address), dto.rack, dto.slot)].append(i)
+
+        values = [None] * len(dtos)
+        for key, indexes in plcs.items():
+            group = [dtos[i] for i in indexes]
+            try:
+                result = self.pool.run(
+                    key, lambda client: self._read_plc(client, group)
+                )
+            except Exception:
+                logging.error(
+                    f"| PLC | Error reading {len(group)} values from:"
+                    f" ip={key[0]}, rack={key[1]}, slot={key[2]}"
+                )
+                continue
+            for i, value in zip(indexes, result):
+                values[i] = value
+
+        return values
+
     def get_all(
             self,
             name: str | None,
@@ -86,12 +306,17 @@ class PlcSensorService(BaseSensorService):
             raise HTTPException(400, "No values to update")
 
         sensor.__dict__.update(values)
+        try:
+            schemas.check_plc_size(sensor.size, sensor.data_type)
+        except ValueError as e:
+            raise HTTPException(422, str(e))
         sensor.enabled = True
+        # check as an unsaved sensor, a rejected update must not leave
+        # this reading in the latest values
+        sensor.id = None
         self._read_by_dto(sensor)
 
-        sensor = self.repo.update_document(
-            ObjectId(id), values, True, self.collection_name
-        )
+        sensor = self._update(id, values)
         return schemas.PlcSensorSchema(**sensor)
 
     def get_value(self, dto: schemas.PlcSensorCreate) -> TitleValueSchema:
@@ -99,7 +324,7 @@ class PlcSensorService(BaseSensorService):
         return data
 
     def get_value_by_id(
-            self, id: str, raise_exception: bool = True
+            self, id: str, raise_exception: bool = True, max_age: float | None = None
     ) -> tuple[TitleValueSchema | None, bool]:
         sensor = self.get_by_id(id)
-        return self._read_by_dto(sensor, True, raise_exception)
+        return self._read_by_dto(sensor, True, raise_exception, max_age)
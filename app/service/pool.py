@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Hashable
+
+from app.service.breaker import CircuitBreakers, CircuitOpenError
+
+
+class PooledConnection:
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.client = None
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """ Long-lived device connections keyed by endpoint """
+
+    name = "POOL"
+
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._connections: dict[Hashable, PooledConnection] = {}
+        self._lock = threading.Lock()
+        self.breakers = CircuitBreakers(self.name)
+
+    def _connect(self, key: Hashable) -> Any:
+        raise NotImplementedError("Subclasses must implement `_connect`")
+
+    def _disconnect(self, client: Any) -> None:
+        raise NotImplementedError("Subclasses must implement `_disconnect`")
+
+    def _is_alive(self, client: Any) -> bool:
+        return True
+
+    def _is_answer(self, error: Exception) -> bool:
+        """ The device answered the request with an error """
+        return False
+
+    def _entry(self, key: Hashable) -> PooledConnection:
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None:
+                entry = PooledConnection(key)
+                self._connections[key] = entry
+            return entry
+
+    def _close(self, entry: PooledConnection) -> None:
+        if entry.client is None:
+            return
+        try:
+            self._disconnect(entry.client)
+        except Exception:
+            logging.warning(f"| {self.name} | Error closing connection: {entry.key}")
+        finally:
+            entry.client = None
+
+    def _open(self, entry: PooledConnection) -> bool:
+        """ Ensure the entry holds a live client, returns True if reconnected """
+        if entry.client is not None and self._is_alive(entry.client):
+            return False
+        self._close(entry)
+        entry.client = self._connect(entry.key)
+        logging.info(f"| {self.name} | Connected: {entry.key}")
+        return True
+
+    def _drop_if_broken(self, entry: PooledConnection) -> bool:
+        """ Close the entry if its connection is dead """
+        if entry.client is not None and self._is_alive(entry.client):
+            return False
+        self._close(entry)
+        return True
+
+    def _record(
+            self, key: Hashable, entry: PooledConnection, error: Exception | None
+    ) -> None:
+        """ Only an error answer proves the endpoint is reachable, timeouts
+        count against the breaker even if the socket is still open """
+        breaker = self.breakers.get(key)
+        if error is None or self._is_answer(error):
+            breaker.record_success()
+            return
+        # a late reply would be taken as the answer to the next request
+        self._close(entry)
+        breaker.record_failure()
+
+    def _reject_if_open(self, key: Hashable) -> None:
+        if self.breakers.get(key).is_open():
+            raise CircuitOpenError(f"Circuit open: {key}")
+
+    def run(self, key: Hashable, func: Callable[[Any], Any]) -> Any:
+        """ Call `func(client)`, retrying once on a fresh connection
+        if a reused one turns out to be broken """
+        self.evict_idle()
+        self._reject_if_open(key)
+        entry = self._entry(key)
+        with entry.lock:
+            # another caller may have opened the breaker while we waited
+            self.breakers.get(key).check()
+            try:
+                reconnected = self._open(entry)
+                try:
+                    result = func(entry.client)
+                except Exception as e:
+                    if self._is_answer(e) or reconnected or not self._drop_if_broken(entry):
+                        raise
+                    logging.warning(f"| {self.name} | Reconnecting: {entry.key}")
+                    self._open(entry)
+                    result = func(entry.client)
+            except Exception as e:
+                self._record(key, entry, e)
+                raise
+            else:
+                self._record(key, entry, None)
+                return result
+            finally:
+                entry.last_used = time.monotonic()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._connections.values())
+        for entry in entries:
+            if entry.client is None or now - entry.last_used < self.idle_timeout:
+                continue
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                if now - entry.last_used >= self.idle_timeout:
+                    logging.info(f"| {self.name} | Evicting idle connection: {entry.key}")
+                    self._close(entry)
+            finally:
+                entry.lock.release()
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+        for entry in entries:
+            with entry.lock:
+                self._close(entry)
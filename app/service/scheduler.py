@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+
 import pytz
 
 from fastapi import HTTPException
@@ -6,7 +8,12 @@ from pymongo import MongoClient
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import (
+    EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+    EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+)
 
+from app import metrics
 from app.service.base import SingletonMeta
 from app.schemas.jobs import JobSchema
 from app.config import settings
@@ -25,6 +32,31 @@ class SchedulerService(metaclass=SingletonMeta):
             job_defaults={'coalesce': True, 'max_instances': 2},
             timezone=pytz.timezone(settings.timezone)
         )
+        self.scheduler.add_listener(
+            self._observe_job,
+            EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR
+            | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+        )
+
+    def _observe_job(self, event) -> None:
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            metrics.SCHEDULER_MISSED_RUNS.labels(event.job_id, "max_instances").inc()
+            return
+        # SUBMITTED is dispatched after the executor took the run, a short
+        # run can finish first, so nothing here relies on the event order
+        if event.code == EVENT_JOB_SUBMITTED:
+            metrics.SCHEDULER_PENDING_RUNS.inc(len(event.scheduled_run_times))
+            return
+        metrics.SCHEDULER_PENDING_RUNS.dec()
+
+        if event.code == EVENT_JOB_MISSED:
+            metrics.SCHEDULER_MISSED_RUNS.labels(event.job_id, "misfire").inc()
+            return
+        outcome = "error" if event.code == EVENT_JOB_ERROR else "success"
+        metrics.JOB_RUNS.labels(event.job_id, outcome).inc()
+        metrics.JOB_RUN_SECONDS.labels(event.job_id).observe(
+            (datetime.now(timezone.utc) - event.scheduled_run_time).total_seconds()
+        )
 
     def start(self):
         self.scheduler.start()
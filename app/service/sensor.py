@@ -1,9 +1,19 @@
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+from app.config import settings
 from app.service.base import SingletonMeta
+from app.service.cache import latest_values
 from app.service.opc import OpcSensorService
 from app.service.plc import PlcSensorService
 from app.service.tcp_modbus import TcpModbusSensorService
 from app.schemas.data import TitleValueSchema
-from app.schemas.sensor import Sensor
+from app.schemas.sensor import Sensor, BreakerSchema, SensorReadSchema
 
 
 class SensorClientService(metaclass=SingletonMeta):
@@ -11,29 +21,140 @@ class SensorClientService(metaclass=SingletonMeta):
         self.opc_service = OpcSensorService()
         self.plc_service = PlcSensorService()
         self.tcp_service = TcpModbusSensorService()
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.sensor_read_workers,
+            thread_name_prefix="sensor-read"
+        )
+        self.values = latest_values
 
     def create_indexes(self):
         self.opc_service.create_index()
         self.plc_service.create_index()
         self.tcp_service.create_index()
 
-    def read_sensor(self, sensor: Sensor) -> tuple[TitleValueSchema | None, bool]:
-        data, is_fault = None, False
-        match sensor.type:
+    def load_configs(self):
+        self.opc_service.configs.start()
+        self.plc_service.configs.start()
+        self.tcp_service.configs.start()
+
+    def stop_configs(self):
+        self.opc_service.configs.stop()
+        self.plc_service.configs.stop()
+        self.tcp_service.configs.stop()
+
+    def close_connections(self):
+        self.opc_service.pool.close_all()
+        self.opc_service.subscriptions.close_all()
+        self.plc_service.pool.close_all()
+        self.tcp_service.pool.close_all()
+        if self.tcp_service.engine is not None:
+            self.tcp_service.engine.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_breakers(self) -> list[BreakerSchema]:
+        breakers = [
+            ("opc", self.opc_service.pool.breakers),
+            ("plc", self.plc_service.pool.breakers),
+            ("tcp_modbus", self.tcp_service.pool.breakers),
+        ]
+        if self.tcp_service.engine is not None:
+            breakers.append(("tcp_modbus", self.tcp_service.engine.breakers))
+        return [
+            BreakerSchema(protocol=protocol, **breaker)
+            for protocol, registry in breakers
+            for breaker in registry.snapshot()
+        ]
+
+    def _get_service(self, sensor_type: str):
+        match sensor_type:
             case "opc":
-                data, is_fault = self.opc_service.get_value_by_id(
-                    sensor.id, False
-                )
+                return self.opc_service
             case "plc":
-                data, is_fault = self.plc_service.get_value_by_id(
-                    sensor.id, False
-                )
+                return self.plc_service
             case "tcp_modbus":
-                data, is_fault = self.tcp_service.get_value_by_id(
-                    sensor.id, False
-                )
+                return self.tcp_service
+
+    def read_sensors(
+            self, sensors: list[Sensor], raise_exception: bool = True
+    ) -> list[tuple[TitleValueSchema | None, bool]]:
+        """ Read every device concurrently under one shared deadline,
+        results keep the input order and late devices count as faults """
+        dtos, groups = [None] * len(sensors), defaultdict(list)
+        for i, sensor in enumerate(sensors):
+            service = self._get_service(sensor.type)
+            try:
+                dtos[i] = service.get_by_id(sensor.id)
+            except (HTTPException, InvalidId):
+                if raise_exception:
+                    raise
+                logging.error(f"| SENSOR | Sensor not found: {sensor.type} {sensor.id}")
+                continue
+            groups[(sensor.type, service.endpoint_key(dtos[i]))].append(i)
+
+        futures = {}
+        for (sensor_type, _), indexes in groups.items():
+            service = self._get_service(sensor_type)
+            future = self.executor.submit(
+                service.get_values, [dtos[i] for i in indexes]
+            )
+            futures[future] = indexes
+
+        results = [(None, True)] * len(sensors)
+        done, pending = wait(futures, timeout=settings.sensor_read_deadline)
+        for future in pending:
+            future.cancel()
+            logging.error(
+                f"| SENSOR | Read deadline of {settings.sensor_read_deadline}s"
+                f" missed by {len(futures[future])} sensors:"
+                f" {[sensors[i].id for i in futures[future]]}"
+            )
+        for future in done:
+            try:
+                values = future.result()
+            except Exception:
+                logging.exception("| SENSOR | Error reading sensors")
+                continue
+            for i, result in zip(futures[future], values):
+                results[i] = result
+
+        return results
 
-        return data, is_fault
+    def read_values(
+            self, sensors: list[Sensor], max_age: float | None = None
+    ) -> list[SensorReadSchema]:
+        """ Bulk read with per-sensor errors and the latency of each device read """
+        started = time.time()
+        if max_age is not None:
+            results = self.read_cached(sensors, max_age, False)
+        else:
+            results = self.read_sensors(sensors, False)
+
+        response = []
+        for sensor, (data, is_fault) in zip(sensors, results):
+            item = SensorReadSchema(
+                id=sensor.id, type=sensor.type, data=data, is_fault=is_fault
+            )
+            latest = self.values.get(sensor.id)
+            if latest is not None:
+                item.latency = latest.latency
+
+            service = self._get_service(sensor.type)
+            try:
+                dto = service.get_by_id(sensor.id)
+            except (HTTPException, InvalidId):
+                item.error = "Sensor not found"
+                response.append(item)
+                continue
+
+            if not dto.enabled:
+                item.error = f"Sensor {dto.name} is disabled"
+            elif is_fault and (latest is None or latest.timestamp < started):
+                item.error = f"No response within {settings.sensor_read_deadline}s"
+            elif is_fault:
+                item.error = f"Value not found for sensor {dto.name}"
+            response.append(item)
+
+        return response
 
     def validate_sensor_args(
             self,
@@ -57,14 +178,43 @@ class SensorClientService(metaclass=SingletonMeta):
 
         return sensors
 
+    def read_cached(
+            self, sensors: list[Sensor], max_age: float, raise_exception: bool = True
+    ) -> list[tuple[TitleValueSchema | None, bool]]:
+        """ Serve sensors read within `max_age` seconds from the latest
+        values, the rest are read from the devices """
+        results, missing = [None] * len(sensors), []
+        for i, sensor in enumerate(sensors):
+            cached = self.values.get(sensor.id, max_age)
+            if cached is not None and not cached.is_fault:
+                results[i] = (cached.data, False)
+            else:
+                missing.append(i)
+
+        if missing:
+            values = self.read_sensors(
+                [sensors[i] for i in missing], raise_exception
+            )
+            for i, result in zip(missing, values):
+                results[i] = result
+
+        return results
+
     def read_sensors_by_id(
-            self, sensors: list[Sensor], summation: bool
+            self, sensors: list[Sensor], summation: bool, max_age: int | None = None
     ) -> tuple[list[TitleValueSchema], bool, bool]:
+        if max_age is None and settings.acquisition_interval > 0:
+            # accept the last acquisition pass, even if it ran to the deadline
+            max_age = settings.acquisition_interval + settings.sensor_read_deadline
+
+        if max_age is not None:
+            results = self.read_cached(sensors, max_age)
+        else:
+            results = self.read_sensors(sensors)
+
         values = []
         title, metric_unit, is_zero, has_fault = "Unknown", "~", True, False
-        for sensor in sensors:
-            data, sensor_fault = self.read_sensor(sensor)
-
+        for data, sensor_fault in results:
             if sensor_fault:
                 has_fault = True
 
@@ -1,48 +1,424 @@
+import asyncio
 import logging
-from bson import ObjectId
+import threading
+from collections import defaultdict
+from typing import Generator
+
 from fastapi import HTTPException
-from pymodbus.client import ModbusTcpClient
+from pymodbus.client import ModbusTcpClient, AsyncModbusTcpClient
+from pymodbus.exceptions import (
+    ModbusException, ModbusIOException, ConnectionException
+)
 
+from app import utils
 from app.schemas import sensor as schemas
 from app.schemas.data import TitleValueSchema
-from app.service.base import BaseSensorService
+from app.service.base import BaseSensorService, SingletonMeta
+from app.service.breaker import CircuitBreakers
+from app.service.pool import ConnectionPool
+from app.config import settings
+
+
+# protocol limit of registers per read holding registers request
+MAX_REGISTERS_PER_READ = 125
+
+ModbusSensor = schemas.TcpModbusSensorSchema | schemas.TcpModbusSensorCreate
+
+
+def plan_gateway_reads(
+        dtos: list[ModbusSensor]
+) -> list[tuple[int, int, int, list[int]]]:
+    """ Merge register spans per unit_id.
+    Returns (unit_id, start, count, sensor indexes) per request """
+    units = defaultdict(list)
+    for i, dto in enumerate(dtos):
+        units[dto.unit_id].append(i)
+
+    plan = []
+    for unit_id, indexes in units.items():
+        spans = [(dtos[i].reg_address, dtos[i].reg_number) for i in indexes]
+        for start, count, members in utils.plan_reads(
+                spans, MAX_REGISTERS_PER_READ, settings.modbus_read_gap
+        ):
+            plan.append((unit_id, start, count, [indexes[m] for m in members]))
+    return plan
+
+
+class ModbusErrorResponse(ModbusException):
+    """ The device answered the request with an exception response """
+
+
+def is_modbus_answer(error: Exception) -> bool:
+    """ An exception response or registers that don't decode,
+    as opposed to a timeout or a broken connection """
+    return isinstance(error, ModbusException) and not isinstance(
+        error, (ModbusIOException, ConnectionException)
+    )
+
+
+def check_registers(response) -> list[int]:
+    if response.isError():
+        raise ModbusErrorResponse(str(response))
+    return response.registers
+
+
+def decode_registers(dto: ModbusSensor, registers: list[int]) -> float | int:
+    value = ModbusTcpClient.convert_from_registers(
+        registers=registers,
+        data_type=ModbusTcpClient.DATATYPE[dto.dtype], # type: ignore
+        word_order=dto.word_order
+    )
+    return sum(value) if isinstance(value, list) else value
+
+
+def decode_members(
+        dtos: list[ModbusSensor],
+        members: list[int],
+        start: int,
+        registers: list[int],
+        values: list[float | int | None]
+) -> None:
+    """ Decode sensors out of the registers of one read,
+    sensors that don't decode are left None """
+    for i in members:
+        offset = dtos[i].reg_address - start
+        try:
+            values[i] = decode_registers(
+                dtos[i], registers[offset:offset + dtos[i].reg_number]
+            )
+        except ModbusException:
+            pass
+
+
+def read_request(
+        dtos: list[ModbusSensor],
+        request: tuple[int, int, int, list[int]],
+        values: list[float | int | None]
+) -> Generator[tuple[int, int, int], list[int], None]:
+    """ Reads of one planned request for both the blocking and async paths.
+    Yields (unit_id, start, count), the caller sends back the registers or
+    throws the ModbusErrorResponse in. A merged read the device rejects is
+    retried sensor by sensor, any other read error is left to the caller """
+    unit_id, start, count, members = request
+    try:
+        registers = yield unit_id, start, count
+    except ModbusErrorResponse:
+        if len(members) == 1:
+            return
+        # one bad register fails the whole merged read
+        for i in members:
+            dto = dtos[i]
+            try:
+                registers = yield unit_id, dto.reg_address, dto.reg_number
+            except ModbusErrorResponse:
+                continue
+            decode_members(dtos, [i], dto.reg_address, registers, values)
+    else:
+        decode_members(dtos, members, start, registers, values)
+
+
+def use_read_timeout(client: ModbusTcpClient | AsyncModbusTcpClient) -> None:
+    """ pymodbus has one timeout for the connect and every response,
+    switch it to the read timeout once connected """
+    # the async client works on the copy held by its transport
+    if isinstance(client, AsyncModbusTcpClient):
+        client.ctx.comm_params.timeout_connect = settings.device_read_timeout
+    else:
+        client.comm_params.timeout_connect = settings.device_read_timeout
+
+
+def log_read_error(dto: ModbusSensor) -> None:
+    logging.error(
+        "| TCP | Error reading value from:"
+        f" ip={dto.ip_address},"
+        f" port={dto.port},"
+        f" reg_address={dto.reg_address}, reg_number={dto.reg_number},"
+        f" unit_id={dto.unit_id}, dtype={dto.dtype}"
+    )
+
+
+def log_read_errors(
+        dtos: list[ModbusSensor], values: list[float | int | None]
+) -> None:
+    for dto, value in zip(dtos, values):
+        if value is None:
+            log_read_error(dto)
+
+
+class ModbusConnectionPool(ConnectionPool, metaclass=SingletonMeta):
+    name = "TCP"
+
+    def __init__(self):
+        super().__init__(settings.connection_idle_timeout)
+
+    def _connect(self, key: tuple[str, int]) -> ModbusTcpClient:
+        client = ModbusTcpClient(
+            host=key[0], port=key[1], timeout=settings.device_connect_timeout, retries=0
+        )
+        if not client.connect():
+            client.close()
+            raise ConnectionError(f"Unable to connect to {key[0]}:{key[1]}")
+        use_read_timeout(client)
+        return client
+
+    def _disconnect(self, client: ModbusTcpClient) -> None:
+        client.close()
+
+    def _is_alive(self, client: ModbusTcpClient) -> bool:
+        return client.connected
+
+    def _is_answer(self, error: Exception) -> bool:
+        return is_modbus_answer(error)
+
+
+class AsyncModbusEngine(metaclass=SingletonMeta):
+    """ Polls every gateway from one event loop thread, a dead
+    gateway only holds a pending coroutine instead of a worker thread """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="modbus-engine", daemon=True
+        )
+        self._thread.start()
+        self._clients: dict[tuple[str, int], AsyncModbusTcpClient] = {}
+        self._limits: dict[tuple[str, int], asyncio.Semaphore] = {}
+        # one connect at a time per gateway, a concurrent one would
+        # replace the client and leak the first
+        self._connect_locks: dict[tuple[str, int], asyncio.Lock] = {}
+        self.breakers = CircuitBreakers("TCP")
+
+    async def _connect(self, key: tuple[str, int]) -> AsyncModbusTcpClient:
+        async with self._connect_locks[key]:
+            client = self._clients.get(key)
+            if client is not None and client.connected:
+                return client
+            if client is not None:
+                client.close()
+            client = AsyncModbusTcpClient(
+                host=key[0], port=key[1], reconnect_delay=0,
+                timeout=settings.device_connect_timeout, retries=0
+            )
+            self._clients[key] = client
+            if not await client.connect():
+                raise ConnectionError(f"Unable to connect to {key[0]}:{key[1]}")
+            use_read_timeout(client)
+            return client
+
+    def _close_client(self, key: tuple[str, int]) -> None:
+        client = self._clients.pop(key, None)
+        if client is not None:
+            client.close()
+
+    async def _read(
+            self,
+            key: tuple[str, int],
+            failed: asyncio.Event,
+            unit_id: int,
+            start: int,
+            count: int
+    ) -> list[int]:
+        """ `failed` is shared by the spans of one pass over the gateway,
+        once one of them times out the spans still queued give up """
+        async with self._limits[key]:
+            if failed.is_set():
+                raise ConnectionError(f"Gateway failed: {key[0]}:{key[1]}")
+            # checked in turn, the span ahead may just have opened it
+            breaker = self.breakers.get(key)
+            breaker.check()
+            try:
+                client = await self._connect(key)
+                response = await client.read_holding_registers(
+                    address=start, count=count, device_id=unit_id
+                )
+            except Exception:
+                failed.set()
+                # closed like a broken pooled connection, see ConnectionPool._record
+                self._close_client(key)
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+            return check_registers(response)
+
+    async def _read_request(
+            self,
+            key: tuple[str, int],
+            failed: asyncio.Event,
+            dtos: list[ModbusSensor],
+            request: tuple[int, int, int, list[int]],
+            values: list[float | int | None]
+    ) -> None:
+        reads = read_request(dtos, request, values)
+        try:
+            read = next(reads)
+            while True:
+                try:
+                    registers = await self._read(key, failed, *read)
+                except ModbusErrorResponse as e:
+                    read = reads.throw(e)
+                else:
+                    read = reads.send(registers)
+        except StopIteration:
+            pass
+
+    async def _read_all(
+            self, dtos: list[ModbusSensor]
+    ) -> list[float | int | None]:
+        gateways = defaultdict(list)
+        for i, dto in enumerate(dtos):
+            gateways[(str(dto.ip_address), dto.port)].append(i)
+
+        tasks, results = [], []
+        for key, indexes in gateways.items():
+            if key not in self._limits:
+                self._limits[key] = asyncio.Semaphore(
+                    settings.modbus_gateway_concurrency
+                )
+                self._connect_locks[key] = asyncio.Lock()
+            group = [dtos[i] for i in indexes]
+            group_values = [None] * len(group)
+            failed = asyncio.Event()
+            for request in plan_gateway_reads(group):
+                tasks.append(
+                    self._read_request(key, failed, group, request, group_values)
+                )
+            results.append((indexes, group_values))
+
+        # a timeout or lost connection leaves the sensors of its spans None
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        values = [None] * len(dtos)
+        for indexes, group_values in results:
+            log_read_errors([dtos[i] for i in indexes], group_values)
+            for i, value in zip(indexes, group_values):
+                values[i] = value
+        return values
+
+    def read_sensors(
+            self, dtos: list[ModbusSensor]
+    ) -> list[tuple[float | int | None, bool]]:
+        """ Same (value, is_fault) contract as the blocking read path """
+        future = asyncio.run_coroutine_threadsafe(self._read_all(dtos), self._loop)
+        return [(value, value is None) for value in future.result()]
+
+    async def _close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
 
 
 class TcpModbusSensorService(BaseSensorService):
+    protocol = "tcp_modbus"
+
     def __init__(self):
         super().__init__("tcp_modbus_sensors")
+        self.pool = ModbusConnectionPool()
+        self.engine = AsyncModbusEngine() if settings.modbus_async_engine else None
 
     @staticmethod
-    def _read_sensor(
-            dto: schemas.TcpModbusSensorSchema | schemas.TcpModbusSensorCreate,
-    ) -> float | int | None:
+    def _read_span(
+            client: ModbusTcpClient, unit_id: int, start: int, count: int
+    ) -> list[int]:
+        response = client.read_holding_registers(
+            address=start, count=count, device_id=unit_id
+        )
+        return check_registers(response)
+
+    def _read_registers(self, client: ModbusTcpClient, dto: ModbusSensor) -> float | int:
+        registers = self._read_span(client, dto.unit_id, dto.reg_address, dto.reg_number)
+        return decode_registers(dto, registers)
+
+    def _read_request(
+            self,
+            client: ModbusTcpClient,
+            dtos: list[ModbusSensor],
+            request: tuple[int, int, int, list[int]],
+            values: list[float | int | None]
+    ) -> None:
+        reads = read_request(dtos, request, values)
         try:
-            client = ModbusTcpClient(host=str(dto.ip_address), port=dto.port)
-            with client:
-                response = client.read_holding_registers(
-                    address=dto.reg_address, count=dto.reg_number, device_id=dto.unit_id
-                )
-                data_type = client.DATATYPE[dto.dtype]
-                value = client.convert_from_registers(
-                    registers=response.registers,
-                    data_type=data_type, # type: ignore
-                    word_order=dto.word_order
-                )
+            read = next(reads)
+            while True:
+                try:
+                    registers = self._read_span(client, *read)
+                except ModbusErrorResponse as e:
+                    read = reads.throw(e)
+                else:
+                    read = reads.send(registers)
+        except StopIteration:
+            pass
+
+    def _read_gateway(
+            self, client: ModbusTcpClient, dtos: list[ModbusSensor]
+    ) -> list[float | int | None]:
+        """ Read every unit with merged register spans,
+        each sensor is decoded from the shared register array.
+        Timeouts and connection errors fail the whole gateway,
+        retrying its sensors one by one would only stall again """
+        values = [None] * len(dtos)
+        plan = plan_gateway_reads(dtos)
+        for request in plan:
+            self._read_request(client, dtos, request, values)
+        log_read_errors(dtos, values)
+
+        logging.info(
+            f"| TCP | Read {len(dtos)} values from:"
+            f" ip={client.comm_params.host} in {len(plan)} requests"
+        )
+        return values
+
+    def _read_sensor(self, dto: ModbusSensor) -> float | int | None:
+        try:
+            value = self.pool.run(
+                (str(dto.ip_address), dto.port),
+                lambda client: self._read_registers(client, dto)
+            )
             logging.info(
                 f"| TCP | Read value from:"
                 f" ip={dto.ip_address},"
                 f" port={dto.port}"
             )
-            return sum(value) if isinstance(value, list) else value
+            return value
         except Exception:
-            logging.error(
-                "| TCP | Error reading value from:"
-                f" ip={dto.ip_address},"
-                f" port={dto.port},"
-                f" reg_address={dto.reg_address}, reg_number={dto.reg_number},"
-                f" unit_id={dto.unit_id}, dtype={dto.dtype}"
-            )
+            log_read_error(dto)
+            return None
+
+    def endpoint_key(self, dto: ModbusSensor) -> tuple[str, int] | None:
+        # the async engine fans out gateways itself, hand it every sensor at once
+        if self.engine is not None:
             return None
+        return str(dto.ip_address), dto.port
+
+    def _read_sensors(
+            self, dtos: list[ModbusSensor]
+    ) -> list[float | int | None]:
+        if self.engine is not None:
+            return [value for value, _ in self.engine.read_sensors(dtos)]
+
+        gateways = defaultdict(list)
+        for i, dto in enumerate(dtos):
+            gateways[(str(dto.ip_address), dto.port)].append(i)
+
+        values = [None] * len(dtos)
+        for key, indexes in gateways.items():
+            group = [dtos[i] for i in indexes]
+            try:
+                result = self.pool.run(
+                    key, lambda client: self._read_gateway(client, group)
+                )
+            except Exception:
+                logging.error(
+                    f"| TCP | Error reading {len(group)} values from:"
+                    f" ip={key[0]}, port={key[1]}"
+                )
+                continue
+            for i, value in zip(indexes, result):
+                values[i] = value
+
+        return values
 
     def get_all(
             self,
@@ -73,11 +449,12 @@ class TcpModbusSensorService(BaseSensorService):
 
         sensor.__dict__.update(values)
         sensor.enabled = True
+        # check as an unsaved sensor, a rejected update must not leave
+        # this reading in the latest values
+        sensor.id = None
         self._read_by_dto(sensor)
 
-        sensor = self.repo.update_document(
-            ObjectId(id), values, True, self.collection_name
-        )
+        sensor = self._update(id, values)
         return schemas.TcpModbusSensorSchema(**sensor)
 
     def get_value(self, dto: schemas.TcpModbusSensorCreate) -> TitleValueSchema:
@@ -85,7 +462,7 @@ class TcpModbusSensorService(BaseSensorService):
         return data
 
     def get_value_by_id(
-            self, id: str, raise_exception: bool = True
+            self, id: str, raise_exception: bool = True, max_age: float | None = None
     ) -> tuple[TitleValueSchema | None, bool]:
         sensor = self.get_by_id(id)
-        return self._read_by_dto(sensor, True, raise_exception)
+        return self._read_by_dto(sensor, True, raise_exception, max_age)
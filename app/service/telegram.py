@@ -6,16 +6,21 @@ from telebot import TeleBot
 from telebot.types import InputMediaPhoto, InputFile
 from telebot.apihelper import ApiTelegramException
 
+from app import metrics
 from app.config import settings
 
 
 def retry_on_rate_limit(func):
     def wrapper(self, *args, max_retries: int = 3, **kwargs):
+        latency = metrics.TELEGRAM_SEND_SECONDS.labels(func.__name__)
         for attempt in range(max_retries):
+            start = time.perf_counter()
             try:
-                return func(self, *args, **kwargs)
+                result = func(self, *args, **kwargs)
             except ApiTelegramException as e:
+                latency.observe(time.perf_counter() - start)
                 if e.error_code == 429:
+                    metrics.TELEGRAM_RATE_LIMIT_RETRIES.labels(func.__name__).inc()
                     sleep_time = int(
                         e.result_json
                         .get("parameters", {})
@@ -26,6 +31,9 @@ def retry_on_rate_limit(func):
                     time.sleep(sleep_time)
                 else:
                     raise
+            else:
+                latency.observe(time.perf_counter() - start)
+                return result
         return None
     return wrapper
 
@@ -0,0 +1,118 @@
+import time
+import logging
+from datetime import datetime, timedelta
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import ASCENDING, DESCENDING
+
+from app.database import MongoDBRepository
+from app.service.write_buffer import WriteBuffer
+from app.config import settings
+
+
+repo = MongoDBRepository(settings.mongodb_db)
+
+
+class JobTrace:
+    def __init__(self, job: str, func: str):
+        self.job = job
+        self.func = func
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.spans: list[dict] = []
+
+    def to_document(self, outcome: str) -> dict:
+        return {
+            "job": self.job,
+            "func": self.func,
+            "started_at": self.started_at,
+            "duration": time.perf_counter() - self.start,
+            "outcome": outcome,
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[JobTrace | None] = ContextVar("job_trace", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """ Time a stage of the running job, a no-op outside of traced jobs """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start, error = time.perf_counter(), None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.spans.append({
+            "name": name,
+            "start": start - trace.start,
+            "duration": time.perf_counter() - start,
+            "error": error,
+        })
+
+
+_collection_ready = False
+
+
+def _ensure_collection() -> None:
+    global _collection_ready
+    if not _collection_ready:
+        repo.create_capped_collection(
+            settings.trace_collection, settings.trace_collection_size,
+            [("job", ASCENDING), ("duration", DESCENDING)]
+        )
+        _collection_ready = True
+
+
+def store_trace(document: dict) -> None:
+    try:
+        _ensure_collection()
+        if settings.write_buffer:
+            WriteBuffer().add(settings.trace_collection, document)
+        else:
+            repo.create_document(document, False, settings.trace_collection, False)
+    except Exception:
+        logging.exception(f"| TRACE | Error storing trace of {document['job']}")
+
+
+def traced(func):
+    """ Record a run of a job function, keyed by its collection name """
+    @wraps(func)
+    def wrapper(collection_name: str, *args, **kwargs):
+        if not settings.trace_jobs:
+            return func(collection_name, *args, **kwargs)
+
+        trace = JobTrace(collection_name, func.__name__)
+        token = _current_trace.set(trace)
+        outcome = "error"
+        try:
+            result = func(collection_name, *args, **kwargs)
+            outcome = "success"
+            return result
+        finally:
+            _current_trace.reset(token)
+            store_trace(trace.to_document(outcome))
+    return wrapper
+
+
+def get_slowest_runs(job: str, hours: int, limit: int) -> list[dict]:
+    _ensure_collection()
+    return repo.get_collection(
+        settings.trace_collection,
+        sort_by="duration",
+        order_by=DESCENDING,
+        query={
+            "job": job,
+            "started_at": {"$gte": datetime.now() - timedelta(hours=hours)}
+        },
+        limit=limit
+    )
@@ -0,0 +1,151 @@
+import logging
+import threading
+
+from app.database import MongoDBRepository
+from app.service.base import SingletonMeta
+from app.config import settings
+
+
+class WriteBuffer(metaclass=SingletonMeta):
+    """ Write-behind buffer of job samples, flushed with one insert_many
+    per collection every write_buffer_interval seconds or as soon as
+    write_buffer_size samples are pending """
+
+    def __init__(self):
+        self.repo = MongoDBRepository(settings.mongodb_db)
+        self._pending: dict[str, list[dict]] = {}
+        # samples being inserted, still visible to readers
+        self._flushing: dict[str, list[dict]] = {}
+        self._size = 0
+        # id(document) -> failed inserts, only for re-queued samples
+        self._attempts: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add(self, collection_name: str, document: dict) -> None:
+        with self._lock:
+            if self._size >= settings.write_buffer_max_size:
+                logging.error(
+                    f"| WRITE BUFFER | Full, dropped a sample of {collection_name}"
+                )
+                return
+            self._pending.setdefault(collection_name, []).append(document)
+            self._size += 1
+            full = self._size >= settings.write_buffer_size
+        if full:
+            self._wake.set()
+
+    def last(self, collection_name: str) -> dict | None:
+        """ Latest sample of the collection that is not in the database yet """
+        with self._lock:
+            documents = (
+                self._pending.get(collection_name)
+                or self._flushing.get(collection_name)
+            )
+            return documents[-1] if documents else None
+
+    def discard(self, collection_name: str) -> None:
+        """ Drop the pending samples of a deleted collection """
+        with self._lock:
+            documents = self._pending.pop(collection_name, [])
+            self._size -= len(documents)
+            for document in documents:
+                self._attempts.pop(id(document), None)
+            # not re-queued if its flush fails
+            self._flushing.pop(collection_name, None)
+
+    def flush(self, collection_name: str | None = None) -> None:
+        """ Insert the pending samples of a collection, or of all of them """
+        with self._flush_lock:
+            with self._lock:
+                if collection_name is None:
+                    self._flushing, self._pending = self._pending, {}
+                elif collection_name in self._pending:
+                    self._flushing = {
+                        collection_name: self._pending.pop(collection_name)
+                    }
+                self._size -= sum(map(len, self._flushing.values()))
+
+            batches = list(self._flushing.items())
+            failed = {}
+            for name, documents in batches:
+                try:
+                    failed[name] = self.repo.try_create_documents(documents, name)
+                except Exception:
+                    logging.exception(
+                        f"| WRITE BUFFER | Error flushing {len(documents)} samples to {name}"
+                    )
+                    failed[name] = documents
+                    continue
+                if failed[name]:
+                    logging.error(
+                        f"| WRITE BUFFER | {len(failed[name])} of {len(documents)}"
+                        f" samples were not inserted into {name}"
+                    )
+
+            with self._lock:
+                for name, documents in batches:
+                    attempts = {}
+                    if self._attempts:
+                        for document in documents:
+                            attempts[id(document)] = self._attempts.pop(id(document), 0)
+                    # a collection discarded meanwhile is not written again
+                    if not failed[name] or name not in self._flushing:
+                        continue
+                    self._requeue(name, failed[name], attempts)
+                self._flushing = {}
+
+    def _requeue(
+            self, collection_name: str, documents: list[dict], attempts: dict[int, int]
+    ) -> None:
+        """ Put failed samples back ahead of the ones added meanwhile,
+        until they run out of attempts or the buffer is full """
+        retry = []
+        for document in documents:
+            count = attempts.get(id(document), 0) + 1
+            if count < settings.write_buffer_max_attempts:
+                self._attempts[id(document)] = count
+                retry.append(document)
+        # the oldest go first when the buffer is full
+        cut = max(0, len(retry) - (settings.write_buffer_max_size - self._size))
+        for document in retry[:cut]:
+            self._attempts.pop(id(document))
+        retry = retry[cut:]
+
+        dropped = len(documents) - len(retry)
+        if dropped:
+            logging.error(
+                f"| WRITE BUFFER | Dropped {dropped} samples of {collection_name},"
+                " out of attempts or the buffer is full"
+            )
+        if retry:
+            self._pending[collection_name] = retry + self._pending.get(collection_name, [])
+            self._size += len(retry)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(settings.write_buffer_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self) -> None:
+        if not settings.write_buffer:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="write-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
@@ -16,5 +16,7 @@ from .time import (
     get_start_of_week,
     calculate_speed,
     current_datetime,
+    get_granularity,
     TIMEZONE
-)
\ No newline at end of file
+)
+from .planner import plan_reads
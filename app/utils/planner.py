@@ -0,0 +1,22 @@
+def plan_reads(
+        spans: list[tuple[int, int]],
+        max_size: int,
+        max_gap: int
+) -> list[tuple[int, int, list[int]]]:
+    """ Merge (start, size) spans into as few reads as possible.
+    Returns (start, size, span indexes) per read """
+    reads = []
+    for i in sorted(range(len(spans)), key=lambda i: spans[i][0]):
+        start, size = spans[i]
+        end = start + size
+        if reads:
+            read_start, read_end, members = reads[-1]
+            if (
+                    start - read_end <= max_gap
+                    and max(end, read_end) - read_start <= max_size
+            ):
+                reads[-1] = (read_start, max(end, read_end), members + [i])
+                continue
+        reads.append((start, end, [i]))
+
+    return [(start, end - start, members) for start, end, members in reads]
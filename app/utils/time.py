@@ -71,3 +71,17 @@ def calculate_speed(diff: float, time_diff_seconds: float) -> float:
     if time_diff_seconds > 0:
         return (3600 / time_diff_seconds) * diff
     return 0.0
+
+
+def get_granularity(trigger) -> str:
+    """ Time-series granularity matching the period of an APScheduler trigger """
+    first = trigger.get_next_fire_time(None, current_datetime())
+    second = first and trigger.get_next_fire_time(first, first + timedelta(microseconds=1))
+    if not second:
+        return "hours"
+    period = (second - first).total_seconds()
+    if period < 60:
+        return "seconds"
+    if period < 3600:
+        return "minutes"
+    return "hours"
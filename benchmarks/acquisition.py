@@ -0,0 +1,133 @@
+""" Acquisition benchmark: single vs batched reads for every protocol
+
+Starts local OPC UA, Modbus TCP and snap7 simulators behind a FaultProxy
+and reads their tags through the sensor services.
+Run with the usual .env present:
+
+    python -m benchmarks.acquisition --protocol all --tags 100 --latency 0.002
+
+The snap7 client always connects to port 102, so the PLC proxy needs it free.
+"""
+import argparse
+from datetime import datetime
+
+from app.schemas import sensor as schemas
+from app.service.opc import OpcSensorService
+from app.service.plc import PlcSensorService
+from app.service.tcp_modbus import TcpModbusSensorService
+
+from benchmarks.simulators import (
+    FaultProxy, OpcSimulator, ModbusSimulator, PlcSimulator
+)
+from benchmarks.stats import timeit, report
+
+
+OPC_PORTS = (48420, 48421)
+MODBUS_PORTS = (15030, 15031)
+PLC_PORTS = (1102, 102)
+
+
+def common_fields(protocol: int, i: int) -> dict:
+    now = datetime.now()
+    return dict(
+        _id=f"{protocol:02x}{i:022x}", name=f"tag_{i}", title=f"Tag {i}",
+        description="benchmark", ip_address="127.0.0.1", enabled=True,
+        metric_unit="ton", coefficient=1.0, created_at=now, updated_at=now,
+    )
+
+
+def opc_sensors(port: int, idx: int, tags: int) -> list[schemas.OpcSensorSchema]:
+    return [
+        schemas.OpcSensorSchema(
+            port=port, node_id={"namespace": idx, "identifier": 1000 + i},
+            **common_fields(1, i)
+        )
+        for i in range(tags)
+    ]
+
+
+def modbus_sensors(port: int, tags: int) -> list[schemas.TcpModbusSensorSchema]:
+    return [
+        schemas.TcpModbusSensorSchema(
+            port=port, reg_address=i, reg_number=1, unit_id=1,
+            dtype="UINT16", word_order="big", **common_fields(2, i)
+        )
+        for i in range(tags)
+    ]
+
+
+def plc_sensors(tags: int) -> list[schemas.PlcSensorSchema]:
+    return [
+        schemas.PlcSensorSchema(
+            db=1, rack=0, slot=1, offset=i * 4, size=4, data_type="REAL",
+            **common_fields(3, i)
+        )
+        for i in range(tags)
+    ]
+
+
+def run(name: str, service, sensors: list, proxy: FaultProxy, repeat: int) -> None:
+    faults = 0
+
+    def single():
+        nonlocal faults
+        for sensor in sensors:
+            _, is_fault = service._read_by_dto(sensor, True, False)
+            faults += is_fault
+
+    def batch():
+        nonlocal faults
+        faults += sum(is_fault for _, is_fault in service.get_values(sensors))
+
+    print(f"--- {name}: {len(sensors)} tags")
+    for label, func, runs in [
+        ("single reads", single, max(1, repeat // 10)),
+        ("batch read", batch, repeat),
+    ]:
+        faults, connections = 0, proxy.connections
+        samples = timeit(func, runs)
+        open_breakers = sum(
+            breaker["state"] == "open" for breaker in service.pool.breakers.snapshot()
+        )
+        report(
+            label, samples, len(sensors),
+            f"  faults={faults}"
+            f"  connections={proxy.connections - connections}"
+            f"  open_breakers={open_breakers}"
+        )
+    service.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--protocol", choices=["opc", "modbus", "plc", "all"], default="all")
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per forwarded chunk")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="chance to drop a connection per chunk")
+    args = parser.parse_args()
+
+    protocols = ["opc", "modbus", "plc"] if args.protocol == "all" else [args.protocol]
+    for protocol in protocols:
+        ports = {"opc": OPC_PORTS, "modbus": MODBUS_PORTS, "plc": PLC_PORTS}[protocol]
+        simulator = {
+            "opc": OpcSimulator, "modbus": ModbusSimulator, "plc": PlcSimulator
+        }[protocol](ports[0], args.tags).start()
+        proxy = FaultProxy(ports[1], ports[0], args.latency, args.fault_rate).start()
+        try:
+            if protocol == "opc":
+                run("OpcSensorService", OpcSensorService(),
+                    opc_sensors(ports[1], simulator.idx, args.tags), proxy, args.repeat)
+            elif protocol == "modbus":
+                run("TcpModbusSensorService", TcpModbusSensorService(),
+                    modbus_sensors(ports[1], args.tags), proxy, args.repeat)
+            else:
+                run("PlcSensorService", PlcSensorService(),
+                    plc_sensors(args.tags), proxy, args.repeat)
+        finally:
+            proxy.stop()
+            simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
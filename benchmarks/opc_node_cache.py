@@ -0,0 +1,54 @@
+""" OPC acquisition benchmark: NodeId parsing vs cached handles
+
+Starts a local OPC UA server and reads its tags through OpcSensorService.
+Run with the usual .env present: python -m benchmarks.opc_node_cache
+"""
+import argparse
+
+from opcua import ua
+
+from app.service.opc import OpcSensorService
+
+from benchmarks.acquisition import opc_sensors
+from benchmarks.simulators import OpcSimulator
+from benchmarks.stats import timeit, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=48410)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    server = OpcSimulator(args.port, args.tags).start()
+    service = OpcSensorService()
+    sensors = opc_sensors(args.port, server.idx, args.tags)
+    try:
+        report(
+            "parse NodeId per read",
+            timeit(lambda: [ua.NodeId.from_string(str(s.node_id)) for s in sensors], args.repeat),
+            args.tags
+        )
+        report(
+            "cached NodeId per sensor",
+            timeit(lambda: [service._get_node_id(s) for s in sensors], args.repeat),
+            args.tags
+        )
+        report(
+            "single reads (pooled)",
+            timeit(lambda: [service._read_sensor(s) for s in sensors], args.repeat // 10 or 1),
+            args.tags
+        )
+        report(
+            "batch read (pooled)",
+            timeit(lambda: service._read_sensors(sensors), args.repeat),
+            args.tags
+        )
+    finally:
+        service.pool.close_all()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
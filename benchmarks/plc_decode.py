@@ -0,0 +1,46 @@
+""" PLC decode benchmark: per-tag snap7.util vs vectorized decode_buffer
+
+Run with the usual .env present: python -m benchmarks.plc_decode
+"""
+import time
+import random
+import argparse
+from statistics import median
+
+import snap7.util as util
+
+from app.service.plc import decode_buffer, PLC_DTYPES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    types = list(PLC_DTYPES)
+    buffer = bytearray(random.randbytes(args.tags * 8))
+    tags = [(i * 8, random.choice(types), random.randrange(8)) for i in range(args.tags)]
+    readers = {
+        "BOOL": lambda data, offset, bit: util.get_bool(data, offset, bit),
+        "INT": lambda data, offset, _: util.get_int(data, offset),
+        "WORD": lambda data, offset, _: util.get_word(data, offset),
+        "DINT": lambda data, offset, _: util.get_dint(data, offset),
+        "REAL": lambda data, offset, _: util.get_real(data, offset),
+        "LREAL": lambda data, offset, _: util.get_lreal(data, offset),
+    }
+
+    def per_tag():
+        return [readers[data_type](buffer, offset, bit) for offset, data_type, bit in tags]
+
+    for name, func in [("snap7.util per tag", per_tag), ("decode_buffer", lambda: decode_buffer(buffer, tags))]:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        print(f"{name:<20} {args.tags} tags  p50={median(samples) * 1e6:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
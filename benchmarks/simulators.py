@@ -0,0 +1,176 @@
+""" Local device simulators for the acquisition benchmarks
+
+Every server listens on a private port and is exposed through a
+FaultProxy, which adds latency, drops connections and counts them.
+"""
+import random
+import struct
+import asyncio
+import ctypes
+import threading
+
+import snap7
+from opcua import Server, ua
+from pymodbus.server import ModbusTcpServer
+from pymodbus.datastore import (
+    ModbusSequentialDataBlock, ModbusDeviceContext, ModbusServerContext
+)
+
+
+class FaultProxy:
+    """ TCP proxy in front of a simulator: `latency` seconds per forwarded
+    chunk and a `fault_rate` chance per chunk to drop the connection """
+
+    def __init__(
+            self,
+            port: int,
+            target_port: int,
+            latency: float = 0.0,
+            fault_rate: float = 0.0,
+            host: str = "127.0.0.1"
+    ):
+        self.host = host
+        self.port = port
+        self.target_port = target_port
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.connections = 0
+        self.active = 0
+        self.dropped = 0
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    async def _pipe(self, reader, writer, peer) -> None:
+        try:
+            while data := await reader.read(65536):
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self.fault_rate and random.random() < self.fault_rate:
+                    self.dropped += 1
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            peer.close()
+
+    async def _handle(self, client_reader, client_writer) -> None:
+        self.connections += 1
+        self.active += 1
+        try:
+            server_reader, server_writer = await asyncio.open_connection(
+                self.host, self.target_port
+            )
+        except OSError:
+            client_writer.close()
+            self.active -= 1
+            return
+        try:
+            await asyncio.gather(
+                self._pipe(client_reader, server_writer, client_writer),
+                self._pipe(server_reader, client_writer, server_writer),
+            )
+        except asyncio.CancelledError:
+            # the proxy is stopping
+            pass
+        finally:
+            self.active -= 1
+
+    def start(self) -> "FaultProxy":
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, self.host, self.port), self._loop
+        ).result()
+        return self
+
+    async def _close(self) -> None:
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class OpcSimulator:
+    """ OPC UA server with `tags` float variables ns=<idx>;i=1000.. """
+
+    def __init__(self, port: int, tags: int):
+        self.port = port
+        self.tags = tags
+        self.server = Server()
+        self.server.set_endpoint(f"opc.tcp://127.0.0.1:{port}")
+        self.idx = self.server.register_namespace("benchmarks")
+        plant = self.server.get_objects_node().add_object(self.idx, "Plant")
+        self.nodes = [
+            plant.add_variable(ua.NodeId(1000 + i, self.idx), f"Counter{i}", float(i))
+            for i in range(tags)
+        ]
+
+    def start(self) -> "OpcSimulator":
+        self.server.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.stop()
+
+
+class ModbusSimulator:
+    """ Modbus TCP server with `tags` holding registers, register i holds i """
+
+    def __init__(self, port: int, tags: int):
+        self.port = port
+        self.tags = tags
+        # pymodbus datablocks are addressed from 1
+        block = ModbusSequentialDataBlock(1, list(range(tags)))
+        self.context = ModbusServerContext(
+            devices=ModbusDeviceContext(hr=block), single=True
+        )
+        self.server = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def start(self) -> "ModbusSimulator":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._serve(), self._loop).result()
+        return self
+
+    async def _serve(self) -> None:
+        self.server = ModbusTcpServer(
+            self.context, address=("127.0.0.1", self.port)
+        )
+        # returns once the port accepts connections
+        await self.server.serve_forever(background=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.server.shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class PlcSimulator:
+    """ snap7 server with DB1 holding `tags` REAL values, tag i at offset 4 * i """
+
+    def __init__(self, port: int, tags: int):
+        self.port = port
+        self.tags = tags
+        self.server = snap7.server.Server(log=False)
+        self.buffer = (ctypes.c_ubyte * (tags * 4))()
+        for i in range(tags):
+            struct.pack_into(">f", self.buffer, i * 4, float(i))
+        self.server.register_area(snap7.types.srvAreaDB, 1, self.buffer)
+
+    def start(self) -> "PlcSimulator":
+        self.server.start(tcpport=self.port)
+        return self
+
+    def stop(self) -> None:
+        self.server.stop()
+        self.server.destroy()
@@ -0,0 +1,25 @@
+import time
+from statistics import median
+
+
+def timeit(func, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples: list[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def report(name: str, samples: list[float], reads: int, extra: str = "") -> None:
+    print(
+        f"{name:<28} p50={median(samples) * 1e6:9.1f}us"
+        f"  p99={percentile(samples, 0.99) * 1e6:9.1f}us"
+        f"  reads/s={reads * len(samples) / sum(samples):10.0f}"
+        f"{extra}"
+    )
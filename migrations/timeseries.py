@@ -0,0 +1,114 @@
+""" Convert existing job collections to time-series collections
+
+Job collections, and the _shift_report ones, are found through the
+scheduler job store. Every plain collection is renamed to <name>_legacy,
+created again as a time-series collection with the granularity of its
+job and refilled from the legacy one in datetime order.
+Stop the app first, a job run in the middle of the migration would
+create the collection again as a plain one:
+
+    python -m migrations.timeseries --dry-run
+    python -m migrations.timeseries --drop-legacy
+"""
+import argparse
+
+from pymongo import ASCENDING
+
+from app import utils
+from app.config import settings
+from app.database import MongoDBRepository
+from app.service.scheduler import SchedulerService
+
+
+LEGACY_SUFFIX = "_legacy"
+GRANULARITIES = ["seconds", "minutes", "hours"]
+
+
+def get_job_collections() -> dict[str, str]:
+    """ Collection name -> granularity of the most frequent job writing to it """
+    scheduler = SchedulerService().scheduler
+    scheduler.start(paused=True)
+    try:
+        jobs = scheduler.get_jobs()
+    finally:
+        scheduler.shutdown(wait=False)
+
+    collections = {}
+    for job in jobs:
+        name = job.kwargs.get("collection_name")
+        if not name:
+            continue
+        granularity = utils.get_granularity(job.trigger)
+        if name not in collections or (
+                GRANULARITIES.index(granularity)
+                < GRANULARITIES.index(collections[name])
+        ):
+            collections[name] = granularity
+    return collections
+
+
+def copy_documents(
+        repo: MongoDBRepository, source: str, target: str, batch_size: int
+) -> int:
+    # paged by datetime, the legacy collections have a unique index on it
+    copied, query = 0, {"datetime": {"$exists": True}}
+    while batch := repo.get_collection(
+            source, sort_by="datetime", order_by=ASCENDING,
+            query=query, limit=batch_size
+    ):
+        for document in batch:
+            document.setdefault("metadata", {"job": target})
+        copied += repo.create_documents(batch, target)
+        query = {"datetime": {"$gt": batch[-1]["datetime"]}}
+    return copied
+
+
+def migrate(
+        repo: MongoDBRepository,
+        name: str,
+        granularity: str,
+        drop_legacy: bool,
+        batch_size: int
+) -> None:
+    legacy = name + LEGACY_SUFFIX
+    total = repo.count_documents(name)
+    repo.rename_collection(name, legacy)
+    try:
+        repo.create_collection(name, granularity)
+    except Exception:
+        # e.g. a server without time-series support, put the data back
+        repo.rename_collection(legacy, name)
+        raise
+    copied = copy_documents(repo, legacy, name, batch_size)
+
+    print(f"{name}: copied {copied}/{total} documents, granularity={granularity}")
+    if copied != total:
+        print(f"{name}: kept {legacy}, documents without datetime were not copied")
+    elif drop_legacy:
+        repo.delete_collection(legacy)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only list the collections to convert")
+    parser.add_argument("--drop-legacy", action="store_true", help="drop <name>_legacy once fully copied")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    repo = MongoDBRepository(settings.mongodb_db)
+    for name, granularity in get_job_collections().items():
+        collection_type = repo.get_collection_type(name)
+        if collection_type != "collection":
+            print(f"{name}: skipped, {collection_type or 'no collection'}")
+            continue
+        if args.dry_run:
+            print(f"{name}: would convert, granularity={granularity}")
+            continue
+        try:
+            migrate(repo, name, granularity, args.drop_legacy, args.batch_size)
+        except Exception as e:
+            print(f"{name}: failed, {e}")
+
+
+if __name__ == "__main__":
+    main()